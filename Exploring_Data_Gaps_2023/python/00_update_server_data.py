@@ -6,12 +6,50 @@ Last Modified: June 26, 2022
 """
 
 # Imports
-import requests
+import itertools
+import os
 import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# The SPARQL client and RDF dump reader are shared with Funerals_2022 and kept in its py directory.
+SHARED_MODULE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Funerals_2022', 'py')
+sys.path.insert(0, SHARED_MODULE_DIR)
+
+import migrations  # noqa: E402 - Imported after SHARED_MODULE_DIR is added to the path.
+import rdf_dump  # noqa: E402
+import sparql_client  # noqa: E402
+
+# Custom Settings
+# 'sparql' queries the DPRR server.  'dump' rebuilds from a local DPRR RDF dump (N-Triples or Turtle) at DUMP_PATH.
+SOURCE = 'sparql'
+DUMP_PATH = 'dprr_dump.nt'
+# How to use cached server responses: 'revalidate', 'replay' (no network), 'refresh', or 'off'.
+CACHE_MODE = sparql_client.REVALIDATE
+CACHE_TTL = 0  # Seconds a cached response is trusted without asking the server.
+# The result format to request.  CSV and TSV are much smaller than JSON and quicker to parse.
+RESULT_FORMAT = sparql_client.JSON_FORMAT
+# Download each query in every result format, print bytes transferred and parse time, and stop without writing.
+BENCHMARK_FORMATS = False
+BULK_UPSERT = True  # Write people and relationships with batched UPSERTs instead of row by row.
+BATCH_SIZE = 1000  # Rows per batched statement.
+COMMIT_SIZE = 5000  # Rows per transaction. Progress is checkpointed after each, so a rerun can resume.
+# 'bulk' suits full refreshes: WAL journal, relaxed syncing, and secondary indexes rebuilt after loading.
+# 'normal' keeps SQLite defaults, which suit small incremental updates.
+LOAD_MODE = 'bulk'
 
 # Constants
 ENDPOINT = 'http://romanrepublic.ac.uk/rdf/endpoint'
 DATABASE_LOCATION = 'roman_prosopography.db'
+CACHE_DIR = 'sparql_cache'
+TRIUMPHATOR_OFFICE = rdf_dump.ENTITY + 'Office/260'
+# The field of each query's rows that identifies the last row written, to check a checkpoint on resume.
+CHECKPOINT_ID_FIELDS = {
+    'people': 'id',
+    'relationships': 'assertion',
+    'triumphators': 'personId'
+}
 
 # The RDF server takes a SPARQL query.
 # SPARQL is a graph database where OPTIONAL is roughly equivalent to LEFT JOIN.
@@ -119,6 +157,12 @@ WHERE {
 }
 """  # noqa: E501 - Ignore line length code quality requirements.
 
+QUERIES = {
+    'people': PEOPLE_QUERY,
+    'relationships': RELATIONSHIP_QUERY,
+    'triumphators': TRIUMPHATOR_QUERY
+}
+
 
 def dict_factory(cursor, row):
     """Allows sqlite queries to return a dict.
@@ -127,93 +171,135 @@ def dict_factory(cursor, row):
     return {key: value for key, value in zip(fields, row)}
 
 
-def setupDatabase(cur):
-    """Create the necessary database tables, if they do not exist."""
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS person(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            nomen TEXT,
-            cognomen TEXT KEY,
-            gender TEXT KEY,
-            highest_office TEXT,
-            birth INTEGER,
-            death INTEGER,
-            dprr_id INTEGER KEY,
-            source TEXT KEY,
-            is_certain TINYINT KEY
-        );
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS relationship_type(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT
-        );
-        """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS relationship(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            about_person INTEGER KEY,
-            related_person INTEGER KEY,
-            type INTEGER KEY,
-            dprr_id INTEGER KEY,
-            source TEXT KEY,
-            FOREIGN KEY(type) REFERENCES relationship_type(id),
-            FOREIGN KEY(about_person) REFERENCES person(id),
-            FOREIGN KEY(related_person) REFERENCES person(id)
-        );
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS triumphator(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            about_person INTEGER KEY,
-            source TEXT KEY,
-            FOREIGN KEY(about_person) REFERENCES person(id)
-        );
-    """)
-
-
-def upsertPeople(cur):
-    """
-    Queries DPRR for people data and inserts or updates them into the database.
+class IdResolver():
+    """
+    Resolves DPRR ids to database ids without a query per row.
+
+    Loads the DPRR id to database id map, the known relationship types, and the people already
+    marked as triumphators once.  Callers add to relationship_types and triumphators as they insert rows.
+    Create it after people have been written so that every DPRR person can be resolved.
+    """
+
+    def __init__(self, cur):
+        """
+        Load the lookups from the database.
+
+        :param cur: The sqlite3 cursor to use to read the database.
+        """
+        self.person_ids = {}
+        for row in cur.execute(migrations.DPRR_PERSON_IDS_QUERY):
+            self.person_ids[row['dprr_id']] = row['id']
+        self.relationship_types = set(row['id'] for row in cur.execute('SELECT id FROM relationship_type'))
+        self.triumphators = set(row['about_person'] for row in cur.execute('SELECT about_person FROM triumphator'))
+
+    def personId(self, dprr_id):
+        """
+        Get the database id of a person.
+
+        :param dprr_id: The person's DPRR id.
+        :return: The database id, or None if the person is not in the database.
+        """
+        return self.person_ids.get(int(dprr_id))
+
+
+def parsePerson(person_dict):
+    """
+    Prepares a row of PEOPLE_QUERY for the database.
+    :param person_dict: A row from sparql_client.iterRows().
+    :returns: A tuple of (name, nomen, cognomen, gender, highest_office, birth, death, dprr_id).
+    """
+    person_id = int(person_dict.get('id', False))
+    name = person_dict.get('name', None)
+    nomen = person_dict.get('nomen', None)
+    cognomen = person_dict.get('cognomen', None)
+    gender = person_dict.get('gender', None)
+    if gender is not None and 'Male' in gender:
+        gender = 'Male'
+    elif gender is not None and 'Female' in gender:
+        gender = 'Female'
+    highest_office = person_dict.get('highestOffice', None)
+    birth = person_dict.get('birth', None)
+    if birth is not None:
+        birth = int(birth)
+    death = person_dict.get('death', None)
+    if death is not None:
+        death = int(death)
+    return (name, nomen, cognomen, gender, highest_office, birth, death, person_id)
+
+
+def parseRelationship(relationship_dict):
+    """
+    Prepares a row of RELATIONSHIP_QUERY for the database.
+    :param relationship_dict: A row from sparql_client.iterRows().
+    :returns: A tuple of DPRR ids and names:
+        (assertion_id, about_person_id, related_person_id, relationship_type_id, relationship_type_name).
+    """
+    relationship_id = relationship_dict.get('assertion', '')
+    relationship_id = int(relationship_id.split('/')[-1])
+    about_person_id = relationship_dict.get('aboutPerson', '')
+    about_person_id = int(about_person_id.split('/')[-1])
+    related_person_id = relationship_dict.get('relatedPerson', '')
+    related_person_id = int(related_person_id.split('/')[-1])
+    relationship_type_id = relationship_dict.get('relationshipID', None)
+    if relationship_type_id is not None:
+        relationship_type_id = int(relationship_type_id)
+    relationship_type_name = relationship_dict.get('relationshipName', None)
+    return (relationship_id, about_person_id, related_person_id, relationship_type_id, relationship_type_name)
+
+
+def batches(rows, batch_size):
+    """
+    Splits rows into lists of at most batch_size rows.
+    :param rows: An iterable of rows.
+    :param batch_size: The largest number of rows in a batch.
+    :returns: A generator of lists of rows.
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def executeBatch(cur, statement, batch, table):
+    """
+    Runs an upsert statement for a batch of rows, falling back to one row at a time if the batch fails.
+    Rows written before a failure are written again, which the ON CONFLICT(dprr_id) clause makes harmless.
     :param cur: The sqlite3 cursor to use to update the database.
+    :param statement: The upsert statement, whose last parameter is the row's DPRR id.
+    :param batch: A list of parameter tuples for the statement.
+    :param table: The name of the table being written, for error messages.
     """
-    results = requests.get(
-        ENDPOINT,
-        params={'query': PEOPLE_QUERY, 'format': 'application/json'}
-    )
-    # If the server is down, raise an exception and end.
-    results.raise_for_status()
-
-    results_json = results.json()
-    keys = results_json['head']['vars']
-    results_json = results_json['results']['bindings']
-
-    for person in results_json:
-        person_dict = {}
-        for key in keys:
-            person_key = person.get(key, {'value': None})
-            person_dict[key] = person_key['value']
+    try:
+        cur.executemany(statement, batch)
+    except sqlite3.Error as e:
+        print(f'Error writing a batch of {len(batch)} {table} rows ({e}). Retrying one row at a time.')
+        for row in batch:
+            try:
+                cur.execute(statement, row)
+            except sqlite3.Error as e:
+                print(f'Error inserting {table} with DPRR id {row[-1]} into database: {e}')
+
+
+def upsertPeople(cur, rows):
+    """
+    Inserts or updates people data from DPRR into the database, one row at a time.
+    :param cur: The sqlite3 cursor to use to update the database.
+    :param rows: The rows of the DPRR response to PEOPLE_QUERY, as returned by sparql_client.iterRows().
+    :returns: The number of rows read.
+    """
+    row_count = 0
+    for person_dict in rows:
+        row_count += 1
         try:
             # Prepare person for database
-            person_id = int(person_dict.get('id', False))
-            name = person_dict.get('name', None)
-            nomen = person_dict.get('nomen', None)
-            cognomen = person_dict.get('cognomen', None)
-            gender = person_dict.get('gender', None)
-            if gender is not None and 'Male' in gender:
-                gender = 'Male'
-            elif gender is not None and 'Female' in gender:
-                gender = 'Female'
-            highest_office = person_dict.get('highestOffice', None)
-            birth = person_dict.get('birth', None)
-            if birth is not None:
-                birth = int(birth)
-            death = person_dict.get('death', None)
-            if death is not None:
-                death = int(death)
+            person_row = parsePerson(person_dict)
+            person_id = person_row[-1]
             # See if we need to insert or update an existing row.
-            res = cur.execute('SELECT * FROM person WHERE dprr_id = ?', (person_id,))
+            res = cur.execute(migrations.PERSON_BY_DPRR_ID_QUERY, (person_id,))
             if len(res.fetchall()) > 0:
                 cur.execute(
                     """
@@ -222,7 +308,7 @@ def upsertPeople(cur):
                         is_certain=1
                     WHERE dprr_id=?
                     """,
-                    (name, nomen, cognomen, gender, highest_office, birth, death, person_id)
+                    person_row
                 )
             else:
                 cur.execute(
@@ -231,64 +317,85 @@ def upsertPeople(cur):
                         is_certain)
                     VALUES (?, ?, ?, ?, ?, ?, ?, "DPRR", ?, 1)
                     """,
-                    (name, nomen, cognomen, gender, highest_office, birth, death, person_id)
+                    person_row
                 )
         except Exception as e:
-            print(f'Error inserting person {person} into database: {e}')
+            print(f'Error inserting person {person_dict} into database: {e}')
+    return row_count
 
 
-def upsertRelationships(cur):
+def bulkUpsertPeople(cur, rows):
     """
-    Queries DPRR for relationship data and inserts or updates them into the database.
+    Inserts or updates people data from DPRR into the database in batches.
+    Rows are parsed as they stream in, so only one batch is held in memory at a time.
+    Relies on the unique index on person.dprr_id to decide between inserting and updating.
+    A batch that fails is retried one row at a time by executeBatch(), so a bad row only loses itself.
     :param cur: The sqlite3 cursor to use to update the database.
+    :param rows: The rows of the DPRR response to PEOPLE_QUERY, as returned by sparql_client.iterRows().
+    :returns: The number of rows read.
     """
-    results = requests.get(
-        ENDPOINT,
-        params={'query': RELATIONSHIP_QUERY, 'format': 'application/json'}
-    )
-    # If the server is down, raise an exception and end.
-    results.raise_for_status()
-
-    results_json = results.json()
-    keys = results_json['head']['vars']
-    results_json = results_json['results']['bindings']
-
-    for relationship in results_json:
-        relationship_dict = {}
-        for key in keys:
-            relationship_key = relationship.get(key, {'value': None})
-            relationship_dict[key] = relationship_key['value']
+    row_count = 0
+
+    def personRows():
+        nonlocal row_count
+        for person_dict in rows:
+            row_count += 1
+            try:
+                yield parsePerson(person_dict)
+            except Exception as e:
+                print(f'Error inserting person {person_dict} into database: {e}')
+
+    for batch in batches(personRows(), BATCH_SIZE):
+        executeBatch(
+            cur,
+            """
+            INSERT INTO person (name, nomen, cognomen, gender, highest_office, birth, death, source, dprr_id,
+                is_certain)
+            VALUES (?, ?, ?, ?, ?, ?, ?, 'DPRR', ?, 1)
+            ON CONFLICT(dprr_id) DO UPDATE SET
+                name=excluded.name, nomen=excluded.nomen, cognomen=excluded.cognomen, gender=excluded.gender,
+                highest_office=excluded.highest_office, birth=excluded.birth, death=excluded.death, source='DPRR',
+                is_certain=1
+            """,
+            batch,
+            'person'
+        )
+    return row_count
+
+
+def upsertRelationships(cur, resolver, rows):
+    """
+    Inserts or updates relationship data from DPRR into the database, one row at a time.
+    :param cur: The sqlite3 cursor to use to update the database.
+    :param resolver: The IdResolver used to convert DPRR ids to database ids.
+    :param rows: The rows of the DPRR response to RELATIONSHIP_QUERY, as returned by sparql_client.iterRows().
+    :returns: The number of rows read.
+    """
+    row_count = 0
+    for relationship in rows:
+        row_count += 1
         try:
             # Prepare relationship for entry by converting DPRR ids to our database's ids.
-            relationship_id = relationship_dict.get('assertion', '')
-            relationship_id = int(relationship_id.split('/')[-1])
-            about_person_id = relationship_dict.get('aboutPerson', '')
-            about_person_id = int(about_person_id.split('/')[-1])
-            related_person_id = relationship_dict.get('relatedPerson', '')
-            related_person_id = int(related_person_id.split('/')[-1])
-            relationship_type_id = relationship_dict.get('relationshipID', None)
-            if relationship_type_id is not None:
-                relationship_type_id = int(relationship_type_id)
-            relationship_type_name = relationship_dict.get('relationshipName', None)
-            res = cur.execute('SELECT * FROM person WHERE dprr_id IN (?, ?)', (about_person_id, related_person_id))
-            about_person_db_id = None
-            related_person_db_id = None
-            for row in res.fetchall():
-                if row['dprr_id'] == about_person_id:
-                    about_person_db_id = row['id']
-                if row['dprr_id'] == related_person_id:
-                    related_person_db_id = row['id']
+            (
+                relationship_id,
+                about_person_id,
+                related_person_id,
+                relationship_type_id,
+                relationship_type_name
+            ) = parseRelationship(relationship)
+            about_person_db_id = resolver.personId(about_person_id)
+            related_person_db_id = resolver.personId(related_person_id)
             if about_person_db_id is None or related_person_db_id is None:
                 print(f'Error looking up people for relationship {relationship}')
                 continue
             # Determine if we should insert or update the relationship_type and relationship.
-            res = cur.execute('SELECT * FROM relationship_type WHERE id = ?', (relationship_type_id,))
-            if len(res.fetchall()) == 0:
+            if relationship_type_id not in resolver.relationship_types:
                 cur.execute(
                     'INSERT INTO relationship_type (id, name) VALUES (?, ?)',
                     (relationship_type_id, relationship_type_name)
                 )
-            res = cur.execute('SELECT * FROM relationship WHERE dprr_id = ?', (relationship_id,))
+                resolver.relationship_types.add(relationship_type_id)
+            res = cur.execute(migrations.RELATIONSHIP_BY_DPRR_ID_QUERY, (relationship_id,))
             if len(res.fetchall()) > 0:
                 cur.execute(
                     """
@@ -308,57 +415,435 @@ def upsertRelationships(cur):
                 )
         except Exception as e:
             print(f'Error inserting relationship {relationship} into database: {e}')
+    return row_count
 
 
-def upsertTriumphators(cur):
+def bulkUpsertRelationships(cur, resolver, rows):
     """
-    Queries DPRR for triumphator data and inserts or updates them into the database.
+    Inserts or updates relationship data from DPRR into the database in batches.
+    Rows are resolved as they stream in, so only one batch is held in memory at a time.
+    The unique index on relationship.dprr_id decides between inserting and updating.
+    A batch that fails is retried one row at a time by executeBatch(), so a bad row only loses itself.
     :param cur: The sqlite3 cursor to use to update the database.
+    :param resolver: The IdResolver used to convert DPRR ids to database ids.
+    :param rows: The rows of the DPRR response to RELATIONSHIP_QUERY, as returned by sparql_client.iterRows().
+    :returns: The number of rows read.
     """
-    results = requests.get(
-        ENDPOINT,
-        params={'query': TRIUMPHATOR_QUERY, 'format': 'application/json'}
-    )
-    # If the server is down, raise an exception and end.
-    results.raise_for_status()
-
-    results_json = results.json()
-    keys = results_json['head']['vars']
-    results_json = results_json['results']['bindings']
-
-    for triumphator in results_json:
-        triumphator_dict = {}
-        for key in keys:
-            triumphator_key = triumphator.get(key, {'value': None})
-            triumphator_dict[key] = triumphator_key['value']
+    row_count = 0
+    new_relationship_types = {}
+
+    def relationshipRows():
+        nonlocal row_count
+        for relationship in rows:
+            row_count += 1
+            try:
+                (
+                    relationship_id,
+                    about_person_id,
+                    related_person_id,
+                    relationship_type_id,
+                    relationship_type_name
+                ) = parseRelationship(relationship)
+            except Exception as e:
+                print(f'Error inserting relationship {relationship} into database: {e}')
+                continue
+            about_person_db_id = resolver.personId(about_person_id)
+            related_person_db_id = resolver.personId(related_person_id)
+            if about_person_db_id is None or related_person_db_id is None:
+                print(f'Error looking up people for relationship {relationship}')
+                continue
+            if relationship_type_id not in resolver.relationship_types:
+                new_relationship_types[relationship_type_id] = relationship_type_name
+                resolver.relationship_types.add(relationship_type_id)
+            yield (about_person_db_id, related_person_db_id, relationship_type_id, relationship_id)
+
+    for batch in batches(relationshipRows(), BATCH_SIZE):
+        # Write any relationship types first seen in this batch.
+        cur.executemany(
+            'INSERT INTO relationship_type (id, name) VALUES (?, ?)',
+            list(new_relationship_types.items())
+        )
+        new_relationship_types.clear()
+        executeBatch(
+            cur,
+            """
+            INSERT INTO relationship (about_person, related_person, type, source, dprr_id)
+            VALUES (?, ?, ?, 'DPRR', ?)
+            ON CONFLICT(dprr_id) DO UPDATE SET
+                about_person=excluded.about_person, related_person=excluded.related_person, type=excluded.type,
+                source='DPRR'
+            """,
+            batch,
+            'relationship'
+        )
+    return row_count
+
+
+def upsertTriumphators(cur, resolver, rows):
+    """
+    Inserts or updates triumphator data from DPRR into the database.
+    :param cur: The sqlite3 cursor to use to update the database.
+    :param resolver: The IdResolver used to convert DPRR ids to database ids.
+    :param rows: The rows of the DPRR response to TRIUMPHATOR_QUERY, as returned by sparql_client.iterRows().
+    :returns: The number of rows read.
+    """
+    row_count = 0
+    for triumphator_dict in rows:
+        row_count += 1
         try:
             # Look up the database ID for this DPRR person ID.
-            about_person_id = triumphator_dict['personId']
-            res = cur.execute('SELECT * FROM person WHERE dprr_id=?', (about_person_id,))
-            about_person_db_id = None
-            for row in res.fetchall():
-                if row['dprr_id'] == int(about_person_id):
-                    about_person_db_id = row['id']
+            about_person_db_id = resolver.personId(triumphator_dict['personId'])
             if about_person_db_id is None:
-                print(f'Error looking up people for triumphator profile {triumphator}')
+                print(f'Error looking up people for triumphator profile {triumphator_dict}')
                 continue
             # Determine if we need to insert the triumphator or if they already are in the database.
-            res = cur.execute('SELECT * FROM triumphator WHERE about_person = ?', (about_person_db_id,))
-            if len(res.fetchall()) == 0:
+            if about_person_db_id not in resolver.triumphators:
                 cur.execute(
                     'INSERT INTO triumphator (about_person, source) VALUES (?, "DPRR")',
                     (about_person_db_id,)
                 )
+                resolver.triumphators.add(about_person_db_id)
         except Exception as e:
-            print(f'Error inserting triumphator {triumphator} into database: {e}')
+            print(f'Error inserting triumphator {triumphator_dict} into database: {e}')
+    return row_count
+
+
+def dprrId(value):
+    """
+    Gets a DPRR id from a SPARQL value, which may be a bare id or an entity URI ending in one.
+    :param value: The value to read.
+    :returns: The DPRR id as an int.
+    """
+    return int(value.split('/')[-1])
+
+
+def readCheckpoint(cur, name, query_key):
+    """
+    Gets the checkpoint a previous, interrupted run left for a query.
+    :param cur: The sqlite3 cursor to use to read the database.
+    :param name: The query's name in CHECKPOINT_ID_FIELDS.
+    :param query_key: The cache key of the query, so a checkpoint for an edited query is ignored.
+    :returns: The checkpoint row as a dict, or None if there is no usable checkpoint.
+    """
+    return cur.execute(migrations.CHECKPOINT_QUERY, (name, query_key)).fetchone()
+
+
+def saveCheckpoint(cur, name, query_key, page, last_dprr_id, finished):
+    """
+    Records how far a query has been written. The caller commits it along with the rows it covers.
+    :param cur: The sqlite3 cursor to use to update the database.
+    :param name: The query's name in CHECKPOINT_ID_FIELDS.
+    :param query_key: The cache key of the query.
+    :param page: How many chunks of COMMIT_SIZE rows have been written.
+    :param last_dprr_id: The DPRR id of the last row written.
+    :param finished: Whether every row of the query has been written.
+    """
+    cur.execute(
+        """
+        INSERT INTO ingest_checkpoint (query, query_key, page, last_dprr_id, finished)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(query) DO UPDATE SET
+            query_key=excluded.query_key, page=excluded.page, last_dprr_id=excluded.last_dprr_id,
+            finished=excluded.finished
+        """,
+        (name, query_key, page, last_dprr_id, int(finished))
+    )
+
+
+def checkpointedWrite(conn, name, query_key, f, write_function, *args):
+    """
+    Writes the rows of a response in chunks of COMMIT_SIZE, committing each chunk with a checkpoint.
+    If an earlier run left a checkpoint for this query, the chunks it wrote are skipped, as long as the
+    response still has the same row where that run stopped.  Otherwise the query is written from the start.
+    :param conn: The sqlite3 connection to the database.
+    :param name: The query's name in CHECKPOINT_ID_FIELDS.
+    :param query_key: The cache key of the query.
+    :param f: The open response file, as returned by fetchQueries().
+    :param write_function: The upsert function to run on each chunk. It must return the number of rows it read.
+    :param args: The arguments to the upsert function, before the rows.
+    :returns: The number of rows read in this run.
+    """
+    cur = conn.cursor()
+    id_field = CHECKPOINT_ID_FIELDS[name]
+    rows = sparql_client.iterRows(f, RESULT_FORMAT)
+    page = 0
+    last_dprr_id = None
+    checkpoint = readCheckpoint(cur, name, query_key)
+    if checkpoint is not None and checkpoint['page'] > 0:
+        last_row = None
+        for last_row in itertools.islice(rows, checkpoint['page'] * COMMIT_SIZE):
+            pass
+        if last_row is not None and dprrId(last_row[id_field]) == checkpoint['last_dprr_id']:
+            page = checkpoint['page']
+            last_dprr_id = checkpoint['last_dprr_id']
+            print(f'Resuming {name} after {page * COMMIT_SIZE} rows.')
+        else:
+            print(f'The {name} response changed since the last checkpoint. Writing it from the start.')
+            f.seek(0)
+            rows = sparql_client.iterRows(f, RESULT_FORMAT)
+    row_count = 0
+    for chunk in batches(rows, COMMIT_SIZE):
+        row_count += write_function(*args, chunk)
+        page += 1
+        last_dprr_id = dprrId(chunk[-1][id_field])
+        saveCheckpoint(cur, name, query_key, page, last_dprr_id, False)
+        conn.commit()
+    saveCheckpoint(cur, name, query_key, page, last_dprr_id, True)
+    conn.commit()
+    return row_count
+
+
+def dumpPeopleRows(graph):
+    """
+    Builds the rows PEOPLE_QUERY would return from a DPRR dump.
+    :param graph: The rdf_dump.DprrGraph read from the dump.
+    :returns: A list of row dicts ordered by DPRR id, leaving out unbound variables as iterRows() does.
+    """
+    required_fields = [('id', 'hasID'), ('name', 'hasName'), ('gender', 'isSex')]
+    optional_fields = [
+        ('nomen', 'hasNomen'), ('cognomen', 'hasCognomen'), ('birth', 'hasEraFrom'), ('death', 'hasEraTo'),
+        ('highestOffice', 'hasHighestOffice')
+    ]
+    variables = [variable for (variable, predicate) in required_fields + optional_fields]
+    rows = []
+    for person in graph.subjects('Person'):
+        # Each combination of values is a row, as in the SPARQL results. OPTIONAL values may be missing.
+        values = [graph.get(person, predicate) for (variable, predicate) in required_fields]
+        values += [graph.get(person, predicate) or [None] for (variable, predicate) in optional_fields]
+        for combination in itertools.product(*values):
+            rows.append({
+                variable: value for (variable, value) in zip(variables, combination) if value is not None
+            })
+    rows.sort(key=lambda row: int(row['id']))
+    return rows
+
+
+def dumpRelationshipRows(graph):
+    """
+    Builds the rows RELATIONSHIP_QUERY would return from a DPRR dump.
+    :param graph: The rdf_dump.DprrGraph read from the dump.
+    :returns: A generator of row dicts, in the order the dump lists the assertions.
+    """
+    for assertion in graph.subjects('RelationshipAssertion'):
+        for relationship in graph.get(assertion, 'hasRelationship'):
+            if not graph.isA(relationship, 'Relationship'):
+                continue
+            for (about_person, related_person, relationship_id, relationship_name) in itertools.product(
+                graph.get(assertion, 'isAboutPerson'),
+                graph.get(assertion, 'hasRelatedPerson'),
+                graph.get(relationship, 'hasID'),
+                graph.get(relationship, 'hasName')
+            ):
+                yield {
+                    'assertion': assertion,
+                    'aboutPerson': about_person,
+                    'relatedPerson': related_person,
+                    'relationship': relationship,
+                    'relationshipID': relationship_id,
+                    'relationshipName': relationship_name
+                }
+
+
+def dumpTriumphatorRows(graph):
+    """
+    Builds the rows TRIUMPHATOR_QUERY would return from a DPRR dump.
+    :param graph: The rdf_dump.DprrGraph read from the dump.
+    :returns: A generator of row dicts, one per triumphator.
+    """
+    seen = set()
+    for post_assertion in graph.subjects('PostAssertion'):
+        if TRIUMPHATOR_OFFICE not in graph.get(post_assertion, 'hasOffice'):
+            continue
+        for person in graph.get(post_assertion, 'isAboutPerson'):
+            if not graph.isA(person, 'Person'):
+                continue
+            for person_id in graph.get(person, 'hasID'):
+                if person_id not in seen:
+                    seen.add(person_id)
+                    yield {'personId': person_id, 'triumphator': 'True'}
+
+
+def startLoad(conn):
+    """
+    Prepares the database for writing according to LOAD_MODE.
+    :param conn: The sqlite3 connection to the database.
+    """
+    if LOAD_MODE == 'bulk':
+        conn.execute('PRAGMA journal_mode = WAL')
+        # NORMAL only syncs at checkpoints in WAL mode. A crash may lose the last commit but not corrupt the file.
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA cache_size = -65536')  # 64 MB
+        conn.execute('PRAGMA temp_store = MEMORY')
+        migrations.dropSecondaryIndexes(conn)
+    elif LOAD_MODE != 'normal':
+        raise ValueError(f'Unknown LOAD_MODE {LOAD_MODE}.')
+
+
+def finishLoad(conn):
+    """
+    Commits the load and restores the database for reading according to LOAD_MODE.
+    :param conn: The sqlite3 connection to the database.
+    """
+    conn.commit()
+    if LOAD_MODE == 'bulk':
+        start = time.perf_counter()
+        migrations.createSecondaryIndexes(conn)
+        conn.commit()
+        print(f'Rebuilt indexes and statistics in {time.perf_counter() - start:.2f} seconds.')
+        # Return to a single database file, since the database is shared through the repository.
+        conn.execute('PRAGMA journal_mode = DELETE')
+
+
+def timedWrite(table, write_function, *args):
+    """
+    Runs a write function and reports how quickly it wrote rows.
+    :param table: The name of the table being written, for the report.
+    :param write_function: The upsert function to run. It must return the number of rows it read.
+    :param args: The arguments to the upsert function.
+    """
+    start = time.perf_counter()
+    row_count = write_function(*args)
+    elapsed = time.perf_counter() - start
+    print(f'Wrote {row_count} {table} rows in {elapsed:.2f} seconds ({row_count / max(elapsed, 1e-9):.0f} rows/sec).')
+
+
+def fetchQueries(client, queries, resumed=()):
+    """
+    Starts all DPRR queries at once, so the total wait is roughly that of the slowest query.
+    :param client: The SparqlClient used to query DPRR. Its session is shared by all requests.
+    :param queries: A dict mapping a name to each SPARQL query to run.
+    :param resumed: Names of queries being resumed from a checkpoint. Their cached responses are reused as is.
+    :returns: A tuple of (executor, futures). futures maps each name to a Future of an open binary file
+        holding the raw response. The caller must close each file and shut the executor down once all results are used.
+    """
+    def timedQuery(name, query):
+        start = time.perf_counter()
+        # If the server is down, an exception is raised when the result is read.
+        response_file = client.openQuery(query, RESULT_FORMAT, revalidate=name not in resumed)
+        print(f'Fetched {name} in {time.perf_counter() - start:.2f} seconds.')
+        return response_file
+
+    executor = ThreadPoolExecutor(max_workers=len(queries))
+    futures = {name: executor.submit(timedQuery, name, query) for name, query in queries.items()}
+    return executor, futures
+
+
+def refreshFromServer(conn, cur):
+    """
+    Queries DPRR and writes the results. Each chunk of rows is committed along with a checkpoint,
+    so if the script stops partway, rerunning it resumes from the last checkpoint.
+    :param conn: The sqlite3 connection to the database.
+    :param cur: The sqlite3 cursor to use to update the database.
+    """
+    client = sparql_client.SparqlClient(ENDPOINT, CACHE_DIR, CACHE_MODE, CACHE_TTL)
+    query_keys = {name: client.cacheKey(query, RESULT_FORMAT) for name, query in QUERIES.items()}
+    checkpoints = {name: readCheckpoint(cur, name, query_keys[name]) for name in QUERIES}
+    finished = [name for name, checkpoint in checkpoints.items() if checkpoint is not None and checkpoint['finished']]
+    for name in finished:
+        print(f'Skipping {name}, which an earlier run finished writing.')
+    executor, futures = fetchQueries(
+        client,
+        {name: query for name, query in QUERIES.items() if name not in finished},
+        [name for name, checkpoint in checkpoints.items() if checkpoint is not None]
+    )
+    # Relationships and triumphators refer to people, so people must be written first.
+    # Responses are parsed as they are written, so they are never held in memory whole.
+    try:
+        startLoad(conn)
+        if 'people' in futures:
+            with futures['people'].result() as f:
+                if BULK_UPSERT:
+                    timedWrite(
+                        'person', checkpointedWrite, conn, 'people', query_keys['people'], f, bulkUpsertPeople, cur
+                    )
+                else:
+                    timedWrite('person', checkpointedWrite, conn, 'people', query_keys['people'], f, upsertPeople, cur)
+        resolver = IdResolver(cur)
+        if 'relationships' in futures:
+            with futures['relationships'].result() as f:
+                if BULK_UPSERT:
+                    timedWrite(
+                        'relationship', checkpointedWrite, conn, 'relationships', query_keys['relationships'], f,
+                        bulkUpsertRelationships, cur, resolver
+                    )
+                else:
+                    timedWrite(
+                        'relationship', checkpointedWrite, conn, 'relationships', query_keys['relationships'], f,
+                        upsertRelationships, cur, resolver
+                    )
+        if 'triumphators' in futures:
+            with futures['triumphators'].result() as f:
+                timedWrite(
+                    'triumphator', checkpointedWrite, conn, 'triumphators', query_keys['triumphators'], f,
+                    upsertTriumphators, cur, resolver
+                )
+    finally:
+        executor.shutdown()
+        client.close()
+
+
+def refreshFromDump(conn, cur):
+    """
+    Reads a local DPRR RDF dump and writes the rows the DPRR queries would return, without using the network.
+    :param conn: The sqlite3 connection to the database.
+    :param cur: The sqlite3 cursor to use to update the database.
+    """
+    start = time.perf_counter()
+    graph = rdf_dump.loadGraph(DUMP_PATH)
+    elapsed = time.perf_counter() - start
+    print(
+        f'Read {graph.triple_count} triples from {DUMP_PATH} in {elapsed:.2f} seconds '
+        f'({graph.triple_count / max(elapsed, 1e-9):.0f} triples/sec).'
+    )
+    startLoad(conn)
+    if BULK_UPSERT:
+        timedWrite('person', bulkUpsertPeople, cur, dumpPeopleRows(graph))
+    else:
+        timedWrite('person', upsertPeople, cur, dumpPeopleRows(graph))
+    resolver = IdResolver(cur)
+    if BULK_UPSERT:
+        timedWrite('relationship', bulkUpsertRelationships, cur, resolver, dumpRelationshipRows(graph))
+    else:
+        timedWrite('relationship', upsertRelationships, cur, resolver, dumpRelationshipRows(graph))
+    timedWrite('triumphator', upsertTriumphators, cur, resolver, dumpTriumphatorRows(graph))
+
+
+def benchmarkFormats():
+    """
+    Downloads each query in every result format and prints the bytes transferred and the time taken to parse.
+    Nothing is cached or written to the database.
+    """
+    client = sparql_client.SparqlClient(ENDPOINT, CACHE_DIR, sparql_client.OFF)
+    try:
+        for name, query in QUERIES.items():
+            for result in sparql_client.benchmarkFormats(client, query):
+                print(
+                    f'{name:<14}{result["format"]:<28}{result["transfer_bytes"]:>12} bytes sent '
+                    f'{result["body_bytes"]:>12} bytes unzipped {result["parse_seconds"]:>8.3f} s to parse '
+                    f'{result["row_count"]:>7} rows{"" if result["same_rows"] else " (rows differ from JSON)"}'
+                )
+    finally:
+        client.close()
+
 
+if BENCHMARK_FORMATS:
+    benchmarkFormats()
+    raise SystemExit
 
-# Query DPRR and update our database. Changes will not save if the script crashes.
+# Update our database from DPRR.
 conn = sqlite3.connect(DATABASE_LOCATION)
 conn.row_factory = dict_factory
+migrations.migrate(conn)
+migrations.reportQueryPlans(conn)
 cur = conn.cursor()
-setupDatabase(cur)
-upsertPeople(cur)
-upsertRelationships(cur)
-upsertTriumphators(cur)
-conn.commit()
\ No newline at end of file
+refresh_start = time.perf_counter()
+if SOURCE == 'sparql':
+    refreshFromServer(conn, cur)
+elif SOURCE == 'dump':
+    refreshFromDump(conn, cur)
+else:
+    raise ValueError(f'Unknown SOURCE {SOURCE}.')
+# Every query was written, so the next run starts a full refresh.
+cur.execute('DELETE FROM ingest_checkpoint')
+finishLoad(conn)
+print(f'Refreshed database in {time.perf_counter() - refresh_start:.2f} seconds.')
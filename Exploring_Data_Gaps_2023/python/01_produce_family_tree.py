@@ -9,6 +9,8 @@ Last Modified: August 24, 2023
 import json
 import sqlite3
 
+import migrations
+
 # Constants
 DATABASE_PATH = 'roman_prosopography.db'
 MAX_BIRTH_YEAR = -130
@@ -40,20 +42,7 @@ def getAllPeople(cur):
     :param cur: The cursor to use to connect to the database.
     :returns: A dict of all people.
     """
-    res = cur.execute('''
-        SELECT
-            p.*,
-            CASE
-                WHEN t.about_person IS NULL THEN 0
-                ELSE 1
-            END AS is_triumphator
-        FROM person AS p
-        LEFT JOIN triumphator AS t
-            ON p.id=t.about_person
-        WHERE p.birth <= ? OR p.birth IS NULL
-        ''',
-        (MAX_BIRTH_YEAR,)
-    )
+    res = cur.execute(migrations.FAMILY_TREE_PEOPLE_QUERY, (MAX_BIRTH_YEAR,))
     return res.fetchall()
 
 
@@ -63,25 +52,7 @@ def getAllRelationships(cur):
     :param cur: The cursor to use to connect to the database.
     :returns: A dict of all relationships.
     """
-    res = cur.execute("""
-    SELECT
-        r.id,
-        r.about_person,
-        r.related_person,
-        p.gender AS related_person_gender,
-        r.type,
-        rt.name
-    FROM relationship AS r
-    INNER JOIN relationship_type AS rt
-        ON r.type = rt.id
-    INNER JOIN person AS p
-        ON r.related_person = p.id
-    INNER JOIN person AS p2
-        ON r.about_person = p2.id
-    WHERE r.type IN (5, 8, 4, 11)  -- (Son, daughter, spouse, divorced)
-        AND (p.birth <= ? OR p.birth IS NULL)
-        AND (p2.birth <= ? OR p2.birth IS NULL)
-    """, (MAX_BIRTH_YEAR, MAX_BIRTH_YEAR))
+    res = cur.execute(migrations.FAMILY_TREE_RELATIONSHIPS_QUERY, (MAX_BIRTH_YEAR, MAX_BIRTH_YEAR))
     return res.fetchall()
 
 
@@ -500,6 +471,9 @@ def generateUniqueGraphs(links_json, person_json, unions_json):
 
 conn = sqlite3.connect(DATABASE_PATH)
 conn.row_factory = dict_factory
+# Bring older databases up to date, including the indexes the queries below rely on.
+migrations.migrate(conn)
+migrations.reportQueryPlans(conn)
 cur = conn.cursor()
 people = getAllPeople(cur)
 # Get a lookup of all genders to add missing relationships to the database.
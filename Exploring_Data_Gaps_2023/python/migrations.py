@@ -0,0 +1,237 @@
+"""
+Creates and upgrades the schema of roman_prosopography.db.
+
+Each migration has a version number.  The database stores the version it has reached in
+PRAGMA user_version, so running migrate() only applies the migrations it is missing.
+Databases created before migrations existed report version 0; migration 1 only creates
+tables that do not exist, so it is safe to run on them.
+
+The lookups that 00_update_server_data.py and 01_produce_family_tree.py make are kept here, so their
+query plans can be checked.  Both scripts warn about any lookup that does not use its index.  Run this
+file directly to upgrade the database and run the same check.  test_migrations.py checks them on a new
+database with pytest.
+"""
+
+# Imports
+import sqlite3
+
+# Constants
+DATABASE_LOCATION = 'roman_prosopography.db'
+
+# Indexes used only for reading.  Bulk loads may drop these and rebuild them afterwards.
+# The unique DPRR id indexes are not included, since UPSERTs depend on them.
+SECONDARY_INDEXES = {
+    'relationship_about_person': 'CREATE INDEX IF NOT EXISTS relationship_about_person ON relationship(about_person);',
+    'relationship_related_person':
+        'CREATE INDEX IF NOT EXISTS relationship_related_person ON relationship(related_person);',
+    'relationship_type_index': 'CREATE INDEX IF NOT EXISTS relationship_type_index ON relationship(type);',
+    'triumphator_about_person': 'CREATE INDEX IF NOT EXISTS triumphator_about_person ON triumphator(about_person);'
+}
+
+# Each migration is (version, description, statements).  Never edit a released migration; add a new one.
+MIGRATIONS = [
+    (1, 'Create tables', [
+        """
+        CREATE TABLE IF NOT EXISTS person(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            nomen TEXT,
+            cognomen TEXT KEY,
+            gender TEXT KEY,
+            highest_office TEXT,
+            birth INTEGER,
+            death INTEGER,
+            dprr_id INTEGER KEY,
+            source TEXT KEY,
+            is_certain TINYINT KEY
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS relationship_type(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS relationship(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            about_person INTEGER KEY,
+            related_person INTEGER KEY,
+            type INTEGER KEY,
+            dprr_id INTEGER KEY,
+            source TEXT KEY,
+            FOREIGN KEY(type) REFERENCES relationship_type(id),
+            FOREIGN KEY(about_person) REFERENCES person(id),
+            FOREIGN KEY(related_person) REFERENCES person(id)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS triumphator(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            about_person INTEGER KEY,
+            source TEXT KEY,
+            FOREIGN KEY(about_person) REFERENCES person(id)
+        );
+        """
+    ]),
+    # DPRR ids must be unique so batched UPSERTs can detect existing rows. Rows we add ourselves have no DPRR id.
+    (2, 'Unique DPRR ids', [
+        'CREATE UNIQUE INDEX IF NOT EXISTS person_dprr_id ON person(dprr_id);',
+        'CREATE UNIQUE INDEX IF NOT EXISTS relationship_dprr_id ON relationship(dprr_id);'
+    ]),
+    # The KEY in the column definitions above is only part of the type name and creates no index.
+    (3, 'Secondary indexes for lookups and joins', list(SECONDARY_INDEXES.values())),
+    # Progress of an interrupted 00_update_server_data.py run, so a rerun can resume where it stopped.
+    (4, 'Ingest checkpoints', [
+        """
+        CREATE TABLE IF NOT EXISTS ingest_checkpoint(
+            query TEXT PRIMARY KEY,
+            query_key TEXT,
+            page INTEGER,
+            last_dprr_id INTEGER,
+            finished TINYINT
+        );
+        """
+    ]),
+]
+
+# Lookups made by 00_update_server_data.py and 01_produce_family_tree.py.  The scripts run these strings, so the
+# checks below explain the same SQL.
+PERSON_BY_DPRR_ID_QUERY = 'SELECT * FROM person WHERE dprr_id = ?'
+RELATIONSHIP_BY_DPRR_ID_QUERY = 'SELECT * FROM relationship WHERE dprr_id = ?'
+DPRR_PERSON_IDS_QUERY = 'SELECT id, dprr_id FROM person WHERE dprr_id IS NOT NULL'
+CHECKPOINT_QUERY = 'SELECT * FROM ingest_checkpoint WHERE query = ? AND query_key = ?'
+FAMILY_TREE_PEOPLE_QUERY = """
+    SELECT
+        p.*,
+        CASE
+            WHEN t.about_person IS NULL THEN 0
+            ELSE 1
+        END AS is_triumphator
+    FROM person AS p
+    LEFT JOIN triumphator AS t
+        ON p.id=t.about_person
+    WHERE p.birth <= ? OR p.birth IS NULL
+    """
+FAMILY_TREE_RELATIONSHIPS_QUERY = """
+    SELECT
+        r.id,
+        r.about_person,
+        r.related_person,
+        p.gender AS related_person_gender,
+        r.type,
+        rt.name
+    FROM relationship AS r
+    INNER JOIN relationship_type AS rt
+        ON r.type = rt.id
+    INNER JOIN person AS p
+        ON r.related_person = p.id
+    INNER JOIN person AS p2
+        ON r.about_person = p2.id
+    WHERE r.type IN (5, 8, 4, 11)  -- (Son, daughter, spouse, divorced)
+        AND (p.birth <= ? OR p.birth IS NULL)
+        AND (p2.birth <= ? OR p2.birth IS NULL)
+    """
+
+# Each lookup above, sample parameters for it, and the index it should use.
+QUERY_PLAN_CHECKS = [
+    (PERSON_BY_DPRR_ID_QUERY, (1,), 'person_dprr_id'),
+    (RELATIONSHIP_BY_DPRR_ID_QUERY, (1,), 'relationship_dprr_id'),
+    (DPRR_PERSON_IDS_QUERY, (), 'person_dprr_id'),
+    (CHECKPOINT_QUERY, ('people', ''), 'sqlite_autoindex_ingest_checkpoint_1'),
+    (FAMILY_TREE_PEOPLE_QUERY, (-130,), 'triumphator_about_person'),
+    (FAMILY_TREE_RELATIONSHIPS_QUERY, (-130, -130), 'relationship_type_index'),
+]
+
+
+def schemaVersion(cur):
+    """
+    Gets the migration version the database has reached.
+    :param cur: The cursor to use to connect to the database.
+    :returns: The version number, or 0 for a new or unversioned database.
+    """
+    return cur.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Applies any migrations the database is missing, in order.
+    :param conn: The sqlite3 connection to upgrade.
+    :returns: The version number the database has reached.
+    """
+    cur = conn.cursor()
+    # Read plain tuples even if the connection uses a dict row factory.
+    cur.row_factory = None
+    version = schemaVersion(cur)
+    for (migration_version, description, statements) in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        print(f'Applying database migration {migration_version}: {description}')
+        with conn:
+            for statement in statements:
+                cur.execute(statement)
+            # PRAGMA does not accept parameters; the version is always one of our own ints.
+            cur.execute(f'PRAGMA user_version = {int(migration_version)}')
+        version = migration_version
+    if version >= 3:
+        # Restore any secondary indexes an interrupted bulk load dropped.
+        for statement in SECONDARY_INDEXES.values():
+            cur.execute(statement)
+    return version
+
+
+def dropSecondaryIndexes(conn):
+    """
+    Drops the indexes in SECONDARY_INDEXES so a bulk load does not maintain them row by row.
+    :param conn: The sqlite3 connection to the database.
+    """
+    for index_name in SECONDARY_INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {index_name}')
+
+
+def createSecondaryIndexes(conn):
+    """
+    Rebuilds the indexes in SECONDARY_INDEXES after a bulk load, then refreshes the planner's statistics.
+    :param conn: The sqlite3 connection to the database.
+    """
+    for statement in SECONDARY_INDEXES.values():
+        conn.execute(statement)
+    conn.execute('ANALYZE')
+
+
+def checkQueryPlans(conn):
+    """
+    Runs EXPLAIN QUERY PLAN on each lookup in QUERY_PLAN_CHECKS.
+    :param conn: The sqlite3 connection to a fully migrated database.
+    :returns: A list of (query, plan) for each lookup that does not use its expected index.
+    """
+    cur = conn.cursor()
+    cur.row_factory = None
+    failures = []
+    for (query, params, index_name) in QUERY_PLAN_CHECKS:
+        plan = [row[-1] for row in cur.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()]
+        if not any(index_name in step for step in plan):
+            failures.append((query, plan))
+    return failures
+
+
+def reportQueryPlans(conn):
+    """
+    Prints each lookup in QUERY_PLAN_CHECKS that does not use its expected index.
+    :param conn: The sqlite3 connection to a fully migrated database.
+    :returns: A list of (query, plan) for each lookup that does not use its expected index.
+    """
+    failures = checkQueryPlans(conn)
+    for (query, plan) in failures:
+        print(f'Query does not use its index:\n{query}\nPlan: {plan}')
+    return failures
+
+
+if __name__ == '__main__':
+    conn = sqlite3.connect(DATABASE_LOCATION)
+    print(f'Database is at migration version {migrate(conn)}.')
+    failures = reportQueryPlans(conn)
+    conn.close()
+    if len(failures) > 0:
+        raise SystemExit(1)
+    print(f'All {len(QUERY_PLAN_CHECKS)} lookups use their indexes.')
@@ -0,0 +1,83 @@
+"""
+Tests that the lookups in migrations.QUERY_PLAN_CHECKS use their indexes on a freshly migrated database.
+
+Run with pytest from this directory.
+"""
+
+# Imports
+import sqlite3
+
+import pytest
+
+import migrations
+
+# Constants
+# Enough rows, spread over enough relationship types, that after ANALYZE the planner prefers each index to a scan,
+# as it does on the full DPRR data.
+PERSON_COUNT = 2000
+RELATIONSHIP_TYPE_COUNT = 30
+TRIUMPHATOR_STEP = 25
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """
+    Creates a new database with migrate(), fills it with sample rows, and runs ANALYZE.
+    :param tmp_path: pytest's temporary directory.
+    :returns: An sqlite3 connection to the database.
+    """
+    conn = sqlite3.connect(tmp_path / 'roman_prosopography.db')
+    migrations.migrate(conn)
+    with conn:
+        conn.executemany(
+            'INSERT INTO person (name, gender, birth, source, dprr_id, is_certain) VALUES (?, ?, ?, "DPRR", ?, 1)',
+            [(f'Person {i}', 'Male', -300 + i % 250, i) for i in range(1, PERSON_COUNT + 1)]
+        )
+        conn.executemany(
+            'INSERT INTO relationship_type (id, name) VALUES (?, ?)',
+            [(i, f'Type {i}') for i in range(1, RELATIONSHIP_TYPE_COUNT + 1)]
+        )
+        conn.executemany(
+            """
+            INSERT INTO relationship (about_person, related_person, type, source, dprr_id)
+            VALUES (?, ?, ?, "DPRR", ?)
+            """,
+            [
+                (i, (i * 7) % PERSON_COUNT + 1, i % RELATIONSHIP_TYPE_COUNT + 1, i)
+                for i in range(1, PERSON_COUNT + 1)
+            ]
+        )
+        conn.executemany(
+            'INSERT INTO triumphator (about_person, source) VALUES (?, "DPRR")',
+            [(i,) for i in range(1, PERSON_COUNT + 1, TRIUMPHATOR_STEP)]
+        )
+        conn.execute("INSERT INTO ingest_checkpoint VALUES ('people', '', 0, 0, 1)")
+    conn.execute('ANALYZE')
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('query, params, index_name', migrations.QUERY_PLAN_CHECKS)
+def test_lookup_uses_index(conn, query, params, index_name):
+    plan = [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()]
+    index_steps = (f'USING INDEX {index_name}', f'USING COVERING INDEX {index_name}')
+    assert any(index_step in step for step in plan for index_step in index_steps), plan
+
+
+def test_check_query_plans_passes(conn):
+    assert migrations.checkQueryPlans(conn) == []
+
+
+def test_check_query_plans_reports_dropped_indexes(conn):
+    migrations.dropSecondaryIndexes(conn)
+    failing_queries = [query for (query, plan) in migrations.checkQueryPlans(conn)]
+    assert failing_queries == [
+        migrations.FAMILY_TREE_PEOPLE_QUERY,
+        migrations.FAMILY_TREE_RELATIONSHIPS_QUERY
+    ]
+
+
+def test_migrate_restores_dropped_indexes(conn):
+    migrations.dropSecondaryIndexes(conn)
+    migrations.migrate(conn)
+    assert migrations.checkQueryPlans(conn) == []
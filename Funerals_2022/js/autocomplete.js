@@ -34,27 +34,8 @@ function setupAutocomplete(personJSON, gensJSON) {
             jQuery("#searchPerson").val(ui.item.value);
             jQuery("#searchedGensID").html('');
             jQuery("#searchGens").val('');
-            jQuery("image.highlighted").each(function(index) {
-                jQuery(this).removeClass('highlighted');
-                jQuery(this).attr('href', function() {
-                    let oldHREF = jQuery(this).attr('href');
-                    return oldHREF.substring(0, oldHREF.length - 16) + '.png';
-                });
-                return true;
-            });
-            jQuery("g, g *").removeClass('notFocused');
-            jQuery("g.funeralGroupInner:not([peopleIncluded*='_" + ui.item.id + "_'])").addClass('notFocused');
-            jQuery("image[personID='" + ui.item.id + "']").each(function(index) {
-                jQuery(this).addClass('highlighted');
-                jQuery(this).attr('href', function() {
-                    let oldHREF = jQuery(this).attr('href');
-                    if (!oldHREF.includes('highlighted')) {
-                        return oldHREF.substring(0, oldHREF.length - 4) + '_highlighted.png';
-                    }
-                    return oldHREF;
-                });
-                return true;
-            });
+            clearFocus();
+            focusPerson(String(ui.item.id));
             return true;
         }
     }),
@@ -73,16 +54,8 @@ function setupAutocomplete(personJSON, gensJSON) {
             jQuery("#searchGens").val(ui.item.value);
             jQuery("#searchedID").html('');
             jQuery("#searchPerson").val('');
-            jQuery("image.highlighted").each(function(index) {
-                jQuery(this).removeClass('highlighted');
-                jQuery(this).attr('href', function() {
-                    let oldHREF = jQuery(this).attr('href');
-                    return oldHREF.substring(0, oldHREF.length - 16) + '.png';
-                });
-                return true;
-            });
-            jQuery("g, g *").removeClass('notFocused');
-            jQuery("image:not([gens='" + ui.item.id + "'])").addClass('notFocused');
+            clearFocus();
+            focusGens(ui.item.id);
             return true;
         }
     }),
@@ -93,27 +66,37 @@ function setupAutocomplete(personJSON, gensJSON) {
     }
 }
 
+/**
+ * Called by the search lookups file of a sharded data file once it loads.
+ * Runs the search for a box that already has text, since the user typed before the lookups arrived.
+ *
+ * @param {object} lookups The people and gens autocomplete possibilities.
+ */
+function registerSearchLookups(lookups) {
+    setupAutocomplete(lookups.people, lookups.gens);
+    jQuery("#searchPerson:focus, #searchGens:focus").autocomplete("search");
+}
+
 /**
  * Adds autocomplete functionality and reset button functionality
  * on page load.
  */
 jQuery(document).ready(function($) {
-    setupAutocomplete(autocompleteJSON, gensJSON);
+    if (typeof funeralManifest === 'undefined') {
+        setupAutocomplete(autocompleteJSON, gensJSON);
+    } else {
+        // Sharded data files load the search lookups only once a search box is used.
+        $("#searchPerson, #searchGens").one('focus', function() {
+            loadScript(funeralManifest.directory + funeralManifest.searchLookups);
+        });
+    }
 
     $('#clearPersonSearch').on('click', function() {
         $("#searchPerson").val('');
         // Make sure clicking clear does not affect other filters.
         if ($("#searchedID").html() != "") {
             $("#searchedID").html('')
-            $('g, g *').removeClass('notFocused');
-            $("image.highlighted").each(function(index) {
-                $(this).removeClass('highlighted');
-                $(this).attr('href', function() {
-                    let oldHREF = $(this).attr('href');
-                    return oldHREF.substring(0, oldHREF.length - 16) + '.png';
-                });
-                return true;
-            });
+            clearFocus();
         }
     });
 
@@ -122,7 +105,7 @@ jQuery(document).ready(function($) {
         // Make sure clicking clear does not affect other filters.
         if ($("#searchedGensID").html() != "") {
             $("#searchedGensID").html('')
-            $('g, g *').removeClass('notFocused');
+            clearFocus();
         }
     })
 });
\ No newline at end of file
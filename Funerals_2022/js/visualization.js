@@ -26,14 +26,29 @@ defaultZoom.y = margin.top;
 
 let zoomScreenSizeMulti = 1.0;
 
+// Sharded data files load each model's time periods only when they are in view.
+let activeModel = 'conservative';
+let shardLayout = [];
+let drawnShards = new Set();
+let requestedShards = new Set();
+let funeralShards = {};
+let periodPeople = null;
+// Each model's funeral index, loaded with its shards when the data file is sharded.
+let shardIndexes = {};
+
+// The drawn funeral groups, by "era_funeral" as listed in funeralIndexes, and those a filter focused.
+let funeralGroups = {};
+let focusedGroups = [];
+
 window.addEventListener("resize", resizeVisualization);
 
 setupDisplayDiv();
-conservativeFuneralData.timePeriods.forEach(setFunerals);
+setModelFunerals(activeModel);
 // Set up the default/maximum zoom to fit all columns in the screen at once.
 defaultZoom.k = width / startingWidth;
 let currentZoom = defaultZoom;
 setZoom();
+loadVisibleShards();
 
 /**
  * Based on the ratio between the old window size and the new one,
@@ -87,6 +102,149 @@ function setupDisplayDiv() {
     maxDivWidth = 0;
     g = null;
     funeralG = null;
+    shardLayout = [];
+    drawnShards = new Set();
+    funeralGroups = {};
+    focusedGroups = [];
+}
+
+/**
+ * Draws the funerals for a model.  For sharded data files, only reserves space for
+ * each time period; loadVisibleShards() then draws the periods in view.
+ *
+ * @param {string} model The model to draw: conservative, aggressive, or hyperaggressive.
+ */
+function setModelFunerals(model) {
+    activeModel = model;
+    if (typeof funeralManifest !== 'undefined') {
+        if (!shardIndexes[model]) {
+            loadScript(funeralManifest.directory + funeralManifest.indexes[model]);
+        }
+        funeralManifest.models[model].forEach(function(shard) {
+            shardLayout.push({
+                x: startingWidth,
+                width: shard.maxFuneralLength * 40,
+                era: eraCount
+            });
+            startingWidth += (shard.maxFuneralLength * 40 + 90);
+            eraCount++;
+        });
+        return;
+    }
+
+    switch (model) {
+        case 'conservative':
+            conservativeFuneralData.timePeriods.forEach(setFunerals);
+            break;
+        case 'aggressive':
+            aggressiveFuneralData.timePeriods.forEach(setFunerals);
+            break;
+        case 'hyperaggressive':
+            hyperaggressiveFuneralData.timePeriods.forEach(setFunerals);
+            break;
+    }
+}
+
+/**
+ * Loads and draws the shards of the active model whose time periods are in view.
+ */
+function loadVisibleShards() {
+    if (typeof funeralManifest === 'undefined') {
+        return;
+    }
+    let left = -currentZoom.x / currentZoom.k;
+    let right = (width - currentZoom.x) / currentZoom.k;
+    shardLayout.forEach(function(layout, index) {
+        // Include the gap after each period so funerals at the edge of the view are loaded.
+        if (layout.x < right && layout.x + layout.width + 90 > left) {
+            loadShard(activeModel, index);
+        }
+    });
+}
+
+/**
+ * Draws a shard, first loading its file if needed.
+ *
+ * @param {string} model The model the shard belongs to.
+ * @param {number} index The index of the shard's time period in the manifest.
+ */
+function loadShard(model, index) {
+    if (drawnShards.has(index)) {
+        return;
+    }
+    if (funeralShards[model] && funeralShards[model][index]) {
+        drawShard(index, funeralShards[model][index]);
+        return;
+    }
+    loadScript(funeralManifest.directory + funeralManifest.models[model][index].file);
+}
+
+/**
+ * Loads a shard or index file, unless it has already been requested.
+ *
+ * @param {string} file The path of the file.
+ */
+function loadScript(file) {
+    if (requestedShards.has(file)) {
+        return;
+    }
+    requestedShards.add(file);
+    // Script tags, unlike fetch(), also work when funerals.html is opened as a local file.
+    let script = document.createElement('script');
+    script.src = file;
+    document.body.appendChild(script);
+}
+
+/**
+ * Called by each model's index file once it loads.
+ *
+ * @param {string} model The model the index belongs to.
+ * @param {object} index The model's funeral index, as in funeralIndexes.
+ */
+function registerFuneralIndex(model, index) {
+    shardIndexes[model] = index;
+    if (model === activeModel) {
+        applyFilters();
+    }
+}
+
+/**
+ * Called by each shard file once it loads.
+ *
+ * @param {string} model The model the shard belongs to.
+ * @param {number} block The block of time of the shard, as listed in the manifest.
+ * @param {object} data The json data for this period's funerals.
+ */
+function registerFuneralShard(model, block, data) {
+    let index = funeralManifest.models[model].findIndex(function(shard) {
+        return shard.block === block;
+    });
+    funeralShards[model] = funeralShards[model] || {};
+    funeralShards[model][index] = data;
+    if (model === activeModel) {
+        drawShard(index, data);
+    }
+}
+
+/**
+ * Draws a loaded shard in the space reserved for its time period.
+ *
+ * @param {number} index The index of the shard's time period in the manifest.
+ * @param {object} data The json data for this period's funerals.
+ */
+function drawShard(index, data) {
+    if (drawnShards.has(index)) {
+        return;
+    }
+    drawnShards.add(index);
+    let savedWidth = startingWidth;
+    let savedEraCount = eraCount;
+    startingWidth = shardLayout[index].x;
+    eraCount = shardLayout[index].era;
+    setFunerals(data);
+    startingWidth = savedWidth;
+    eraCount = savedEraCount;
+    applyFilters();
 }
 
 /**
@@ -151,6 +309,22 @@ function setPoints(data) {
             });
 }
 
+/**
+ * Gets the people in a funeral.  Compact data files list each funeral as person IDs,
+ * which are looked up in funeralPeople, or in the shard's own people when sharded.
+ *
+ * @param {object} data The json data or person IDs for this funeral.
+ * @returns {object} The json data for each person in this funeral.
+ */
+function getFuneralPeople(data) {
+    if (periodPeople === null) {
+        return data;
+    }
+    return data.map(function(personID) {
+        return periodPeople[personID];
+    });
+}
+
 /**
  * Creates a group for the new funeral, updating counts and sizes accordingly.
  *
@@ -162,7 +336,8 @@ function setFuneral(data) {
         .attr('funeralEra', eraCount)
         .attr('funeralNumber', funeralCountForEra)
         .attr('peopleIncluded', '_');
-    setPoints(data);
+    funeralGroups[eraCount + '_' + funeralCountForEra] = funeralG.node();
+    setPoints(getFuneralPeople(data));
     funeralCountForEra++;
     if (count * 40 > maxColumnWidth) {
         maxColumnWidth = count * 40;
@@ -182,6 +357,11 @@ function setFunerals(data) {
         .attr('timePeriod', data.timePeriod)
         .attr('eraCount', eraCount);
     g.insert('text').text(data.timePeriod).attr('x', startingWidth + 30);
+    if (data.people) {
+        periodPeople = data.people;
+    } else {
+        periodPeople = (typeof funeralPeople === 'undefined') ? null : funeralPeople;
+    }
     data.funerals.forEach(setFuneral);
     startingWidth += (maxColumnWidth + 90);
     eraCount++;
@@ -217,6 +397,108 @@ function handleZoom(e) {
     currentZoom = e.transform;
     d3.select("svg g")
         .attr("transform", e.transform);
+    loadVisibleShards();
+}
+
+/**
+ * Gets the drawn funeral groups that an inverted index of the active model lists for a key.
+ * Sharded data files have no groups to return until the model's index has loaded.
+ *
+ * @param {string} indexName The index to use: people or gens.
+ * @param {string} key The person ID or gens to look up.
+ * @returns {Array} The group elements of the matching funerals that have been drawn.
+ */
+function getIndexedGroups(indexName, key) {
+    let groups = [];
+    let index = (typeof funeralManifest === 'undefined') ? funeralIndexes[activeModel] : shardIndexes[activeModel];
+    if (!index) {
+        return groups;
+    }
+    (index[indexName][key] || []).forEach(function(funeralID) {
+        if (funeralGroups[funeralID]) {
+            groups.push(funeralGroups[funeralID]);
+        }
+    });
+    return groups;
+}
+
+/**
+ * Switches an image to its highlighted icon.
+ */
+function highlightImage() {
+    jQuery(this).addClass('highlighted');
+    jQuery(this).attr('href', function() {
+        let oldHREF = jQuery(this).attr('href');
+        if (!oldHREF.includes('highlighted')) {
+            return oldHREF.substring(0, oldHREF.length - 4) + '_highlighted.png';
+        }
+        return oldHREF;
+    });
+    return true;
+}
+
+/**
+ * Switches a highlighted image back to its normal icon.
+ */
+function unhighlightImage() {
+    jQuery(this).removeClass('highlighted');
+    jQuery(this).attr('href', function() {
+        let oldHREF = jQuery(this).attr('href');
+        return oldHREF.substring(0, oldHREF.length - 16) + '.png';
+    });
+    return true;
+}
+
+/**
+ * Removes any person or gens filter.  Only the groups the filter focused are changed.
+ */
+function clearFocus() {
+    jQuery('#allFuneralsGroup').removeClass('filtered');
+    let groups = jQuery(focusedGroups);
+    groups.removeClass('focused');
+    groups.find('image.notFocused').removeClass('notFocused');
+    groups.find('image.highlighted').each(unhighlightImage);
+    focusedGroups = [];
+}
+
+/**
+ * Dims every funeral without a person, and highlights the person in the rest.
+ *
+ * @param {string} personID The DPRR ID of the person.
+ */
+function focusPerson(personID) {
+    let groups = getIndexedGroups('people', personID);
+    focusedGroups = focusedGroups.concat(groups);
+    jQuery('#allFuneralsGroup').addClass('filtered');
+    jQuery(groups).addClass('focused');
+    jQuery(groups).find("image[personID='" + personID + "']").each(highlightImage);
+}
+
+/**
+ * Dims everyone not in a gens.
+ *
+ * @param {string} gens The nomen of the gens.
+ */
+function focusGens(gens) {
+    let groups = getIndexedGroups('gens', gens);
+    focusedGroups = focusedGroups.concat(groups);
+    jQuery('#allFuneralsGroup').addClass('filtered');
+    jQuery(groups).addClass('focused');
+    jQuery(groups).find("image:not([gens='" + gens + "'])").addClass('notFocused');
+}
+
+/**
+ * Reapplies the current person or gens filter, if any, based on the hidden IDs that track them.
+ */
+function applyFilters() {
+    selectedID = jQuery("#searchedID").html();
+    selectedGensID = jQuery("#searchedGensID").html();
+    clearFocus();
+    if (selectedID) {
+        focusPerson(selectedID);
+    } else if (selectedGensID) {
+        focusGens(selectedGensID);
+    }
 }
 
 /**
@@ -226,18 +508,7 @@ function handleZoom(e) {
  */
 jQuery('select#algorithm').on('change', function() {
     setupDisplayDiv();
-
-    switch (this.value) {
-        case 'conservative':
-            conservativeFuneralData.timePeriods.forEach(setFunerals);
-            break;
-        case 'aggressive':
-            aggressiveFuneralData.timePeriods.forEach(setFunerals);
-            break;
-        case 'hyperaggressive':
-            hyperaggressiveFuneralData.timePeriods.forEach(setFunerals);
-            break;
-    }
+    setModelFunerals(this.value);
 
     // Set up the default/maximum zoom to fit all columns in the screen at once.
     defaultZoom.k = width / startingWidth;
@@ -245,25 +516,8 @@ jQuery('select#algorithm').on('change', function() {
     currentZoom = defaultZoom;
 
     setZoom();
+    loadVisibleShards();
 
-    // Preserve the current filter, if any, based on the hidden ID that tracks these filters.
-    selectedID = jQuery("#searchedID").html();
-    selectedGensID = jQuery("#searchedGensID").html();
-    if (selectedID) {
-        jQuery("g.funeralGroupInner:not([peopleIncluded*='_" + selectedID + "_'])").addClass('notFocused');
-        jQuery("image[personID='" + selectedID + "']").each(function(index) {
-            jQuery(this).addClass('highlighted');
-            jQuery(this).attr('href', function() {
-                let oldHREF = jQuery(this).attr('href');
-                if (!oldHREF.includes('highlighted')) {
-                    return oldHREF.substring(0, oldHREF.length - 4) + '_highlighted.png';
-                }
-                return oldHREF;
-            });
-            return true;
-        });
-    } else if (selectedGensID) {
-        jQuery("g, g *").removeClass('notFocused');
-        jQuery("image:not([gens='" + selectedGensID + "'])").addClass('notFocused');
-    }
+    // Preserve the current filter, if any.
+    applyFilters();
 });
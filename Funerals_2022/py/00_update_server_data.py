@@ -6,18 +6,48 @@ Last Modified: June 26, 2022
 """
 
 # Imports
-import requests
+import itertools
 import json
+import os
+import time
+
+import rdf_dump
+import sparql_client
+
+# Custom Settings
+# DPRR IDs fetched per request. Set to 0 to fetch everything at once.
+PAGE_SIZE = 500
+MAX_RETRIES = 3    # Attempts per page before giving up.
+RETRY_DELAY = 5    # Seconds to wait before the first retry. Doubles each time.
+# How to use cached server responses: 'revalidate', 'replay' (no network),
+# 'refresh', or 'off'.
+CACHE_MODE = sparql_client.REVALIDATE
+CACHE_TTL = 0      # Seconds a cached response is trusted without asking.
+# The result format to request.  CSV and TSV are much smaller than JSON and
+# quicker to parse.
+RESULT_FORMAT = sparql_client.JSON_FORMAT
+# 'combined' runs the single query below. 'narrow' runs one small query per
+# attribute and joins them by ID, avoiding the duplicate rows OPTIONAL groups
+# produce.  'dump' joins the same attributes from a local DPRR RDF dump
+# (N-Triples or Turtle) at DUMP_PATH, with no network.
+FETCH_STRATEGY = 'narrow'
+DUMP_PATH = '../json/dprr_dump.nt'
 
 # Constants
 ENDPOINT = 'http://romanrepublic.ac.uk/rdf/endpoint'
 WRITE_PATH = '../json/database_data.json'
+CACHE_DIR = '../json/sparql_cache'
+PAGE_FILTER_MARKER = '# PAGE_FILTER'
+MALE = rdf_dump.ENTITY + 'Sex/Male'
+TRIUMPHATOR_OFFICE = rdf_dump.ENTITY + 'Office/260'
+FATHER_RELATIONSHIP = rdf_dump.ENTITY + 'Relationship/5'
+GRANDFATHER_RELATIONSHIP = rdf_dump.ENTITY + 'Relationship/19'
 
 
 # The RDF server takes a SPARQL query.
 # SPARQL is a graph database where OPTIONAL is roughly equivalent to LEFT JOIN.
 # An OPTIONAL group will only return data if all fields in it are not null.
-query = """
+query = f"""
 PREFIX : <http://romanrepublic.ac.uk/rdf/ontology#>
 PREFIX owl: <http://www.w3.org/2002/07/owl#>
 PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
@@ -41,96 +71,479 @@ SELECT DISTINCT
     ?fatherIsUncertain
     ?grandfatherID
     ?grandfatherIsUncertain
-WHERE {
+WHERE {{
     ?aperson a vocab:Person;
-        vocab:isSex <http://romanrepublic.ac.uk/rdf/entity/Sex/Male>;
+        vocab:isSex <{MALE}>;
         vocab:hasID ?id;
         vocab:hasName ?name;
-    OPTIONAL {
+    OPTIONAL {{
         ?aperson a vocab:Person;
             vocab:hasNomen ?nomen;
-    }
-    OPTIONAL {
+    }}
+    OPTIONAL {{
         ?aperson a vocab:Person;
             vocab:hasCognomen ?cognomen;
-    }
-    OPTIONAL {
+    }}
+    OPTIONAL {{
         ?aperson a vocab:Person;
             vocab:hasEraFrom ?birth;
-    }
-    OPTIONAL {
+    }}
+    OPTIONAL {{
         ?aperson a vocab:Person;
             vocab:hasEraTo ?death;
-    }
-    OPTIONAL {
+    }}
+    OPTIONAL {{
         ?aperson a vocab:Person;
             vocab:hasHighestOffice ?highestOffice.
-    }
-    OPTIONAL {
+    }}
+    OPTIONAL {{
         ?postAssert a vocab:PostAssertion;
             vocab:hasOffice ?office;
             vocab:isAboutPerson ?aperson.
-        FILTER (?office = <http://romanrepublic.ac.uk/rdf/entity/Office/260>)
+        FILTER (?office = <{TRIUMPHATOR_OFFICE}>)
         BIND ('True' as ?triumphator)
-    }
-    OPTIONAL {
+    }}
+    OPTIONAL {{
         ?relAssert a vocab:RelationshipAssertion;
             vocab:isAboutPerson ?aperson;
-            vocab:hasRelationship <http://romanrepublic.ac.uk/rdf/entity/Relationship/5>;
+            vocab:hasRelationship <{FATHER_RELATIONSHIP}>;
             vocab:hasRelatedPerson ?relat.
         ?relat a vocab:Person;
-            vocab:isSex <http://romanrepublic.ac.uk/rdf/entity/Sex/Male>;
+            vocab:isSex <{MALE}>;
             vocab:hasID ?fatherID.
-    }
-    OPTIONAL {
+    }}
+    OPTIONAL {{
         ?relAssert a vocab:RelationshipAssertion;
             vocab:isAboutPerson ?aperson;
-            vocab:hasRelationship <http://romanrepublic.ac.uk/rdf/entity/Relationship/5>;
+            vocab:hasRelationship <{FATHER_RELATIONSHIP}>;
             vocab:isUncertain ?fatherIsUncertain;
             vocab:hasRelatedPerson ?relat.
         ?relat a vocab:Person;
-            vocab:isSex <http://romanrepublic.ac.uk/rdf/entity/Sex/Male>.
-    }
-    OPTIONAL {
+            vocab:isSex <{MALE}>.
+    }}
+    OPTIONAL {{
         ?relAssert a vocab:RelationshipAssertion;
             vocab:isAboutPerson ?aperson;
-            vocab:hasRelationship <http://romanrepublic.ac.uk/rdf/entity/Relationship/19>;
+            vocab:hasRelationship <{GRANDFATHER_RELATIONSHIP}>;
             vocab:hasRelatedPerson ?relat.
         ?relat a vocab:Person;
-            vocab:isSex <http://romanrepublic.ac.uk/rdf/entity/Sex/Male>;
+            vocab:isSex <{MALE}>;
             vocab:hasID ?grandfatherID.
-    }
-    OPTIONAL {
+    }}
+    OPTIONAL {{
         ?relAssert a vocab:RelationshipAssertion;
             vocab:isAboutPerson ?aperson;
-            vocab:hasRelationship <http://romanrepublic.ac.uk/rdf/entity/Relationship/19>;
+            vocab:hasRelationship <{GRANDFATHER_RELATIONSHIP}>;
             vocab:isUncertain ?grandfatherIsUncertain;
             vocab:hasRelatedPerson ?relat.
         ?relat a vocab:Person;
-            vocab:isSex <http://romanrepublic.ac.uk/rdf/entity/Sex/Male>.
-    }
-}
+            vocab:isSex <{MALE}>.
+    }}
+    # PAGE_FILTER
+}}
+ORDER BY ?id
+"""
+
+# Narrow queries fetch one attribute group each.  They are joined by ID in
+# Python, so a person with several fathers no longer multiplies every other
+# attribute.  Keys are the output columns in the order the combined query
+# returns them.
+OUTPUT_KEYS = [
+    'id', 'name', 'nomen', 'cognomen', 'highestOffice', 'birth', 'death',
+    'triumphator', 'fatherID', 'fatherIsUncertain', 'grandfatherID',
+    'grandfatherIsUncertain'
+]
+NARROW_QUERY_TEMPLATE = """
+PREFIX vocab: <http://romanrepublic.ac.uk/rdf/ontology#>
+
+SELECT DISTINCT
+    ?id
+    {variables}
+WHERE {{
+    ?aperson a vocab:Person;
+        vocab:isSex <http://romanrepublic.ac.uk/rdf/entity/Sex/Male>;
+        vocab:hasID ?id.
+    {pattern}
+    # PAGE_FILTER
+}}
 ORDER BY ?id
-"""  # noqa: E501 - Ignore line length code quality requirements.
+"""
+# Maps each attribute group to (variables, pattern).  The name query defines
+# which people exist.
+NARROW_QUERIES = {
+    'name': (['name'], '?aperson vocab:hasName ?name.'),
+    'nomen': (['nomen'], '?aperson vocab:hasNomen ?nomen.'),
+    'cognomen': (['cognomen'], '?aperson vocab:hasCognomen ?cognomen.'),
+    'highestOffice': (
+        ['highestOffice'],
+        '?aperson vocab:hasHighestOffice ?highestOffice.'
+    ),
+    'birth': (['birth'], '?aperson vocab:hasEraFrom ?birth.'),
+    'death': (['death'], '?aperson vocab:hasEraTo ?death.'),
+    'triumphator': (['triumphator'], f"""
+    ?postAssert a vocab:PostAssertion;
+        vocab:hasOffice <{TRIUMPHATOR_OFFICE}>;
+        vocab:isAboutPerson ?aperson.
+    BIND ('True' as ?triumphator)"""),
+    'father': (['fatherID', 'fatherIsUncertain'], f"""
+    ?relAssert a vocab:RelationshipAssertion;
+        vocab:isAboutPerson ?aperson;
+        vocab:hasRelationship <{FATHER_RELATIONSHIP}>;
+        vocab:hasRelatedPerson ?relat.
+    ?relat a vocab:Person;
+        vocab:isSex <{MALE}>;
+        vocab:hasID ?fatherID.
+    OPTIONAL {{
+        ?relAssert vocab:isUncertain ?fatherIsUncertain.
+    }}"""),
+    'grandfather': (['grandfatherID', 'grandfatherIsUncertain'], f"""
+    ?relAssert a vocab:RelationshipAssertion;
+        vocab:isAboutPerson ?aperson;
+        vocab:hasRelationship <{GRANDFATHER_RELATIONSHIP}>;
+        vocab:hasRelatedPerson ?relat.
+    ?relat a vocab:Person;
+        vocab:isSex <{MALE}>;
+        vocab:hasID ?grandfatherID.
+    OPTIONAL {{
+        ?relAssert vocab:isUncertain ?grandfatherIsUncertain.
+    }}""")
+}
+
+# Used to determine how many ID windows are needed when paging.
+MAX_ID_QUERY = """
+PREFIX vocab: <http://romanrepublic.ac.uk/rdf/ontology#>
+
+SELECT (MAX(?id) AS ?maxID)
+WHERE {
+    ?aperson a vocab:Person;
+        vocab:hasID ?id.
+}
+"""
+
+
+def runQuery(query):
+    """
+    Run a query through the response cache, retrying with a growing delay if
+    the download fails.  A response that cannot be parsed, or a query missing
+    from the cache in replay mode, would fail the same way again, so its
+    error is raised at once.
+
+    :param query: The SPARQL query to run.
+    :return: A list of dicts mapping each bound variable to its value.
+    """
+    delay = RETRY_DELAY
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            with client.openQuery(query, RESULT_FORMAT) as f:
+                return list(sparql_client.iterRows(f, RESULT_FORMAT))
+        except sparql_client.NETWORK_ERRORS as e:
+            if attempt == MAX_RETRIES:
+                raise
+            print(f'Query failed ({e}), retrying in {delay} seconds.')
+            time.sleep(delay)
+            delay *= 2
+
+
+def getMaxID():
+    """
+    Find the largest person ID on the DPRR server.
+
+    :return: The largest person ID, as an int.
+    """
+    return int(runQuery(MAX_ID_QUERY)[0]['maxID'])
+
+
+def getPageFilters():
+    """
+    Build the filters needed to fetch all person data page by page.
+
+    Each page covers a window of DPRR IDs rather than a LIMIT/OFFSET range.
+    Since a person may return several rows, this keeps all of a person's rows
+    on the same page and lets a single page be retried on its own.
+
+    :return: A generator of SPARQL FILTER clauses, one per page.
+    """
+    if PAGE_SIZE <= 0:
+        yield ''
+        return
+    max_id = getMaxID()
+    for start_id in range(0, max_id + 1, PAGE_SIZE):
+        end_id = start_id + PAGE_SIZE
+        yield f'FILTER (?id >= {start_id} && ?id < {end_id})'
+
+
+def flattenBindings(rows, keys):
+    """
+    Give every row a value for each query variable.
+
+    :param rows: The rows returned by runQuery(), which leave out unbound
+        variables.
+    :param keys: The query's variables, in the order they should appear.
+    :return: A generator of dicts mapping each query variable to its value,
+        or None if it is unbound.
+    """
+    for person in rows:
+        yield {key: person.get(key) for key in keys}
+
+
+def fetchCombinedPage(page_filter, stats):
+    """
+    Fetch one page of person data with the single combined query.
+
+    :param page_filter: The FILTER clause selecting this page.
+    :param stats: A dict of counters, updated in place.
+    :return: A list of person rows, possibly several per person.
+    """
+    page_query = query.replace(PAGE_FILTER_MARKER, page_filter)
+    rows = list(flattenBindings(runQuery(page_query), OUTPUT_KEYS))
+    stats['fetched_rows'] += len(rows)
+    return rows
+
+
+def joinGroups(group_rows, stats):
+    """
+    Join the rows of each attribute group into one row per person.
+
+    A person with more than one value for a group (for example, two attested
+    fathers) is logged as a conflict.  As before, the last value returned by
+    the server is kept.  As in the combined query, whose father and
+    grandfather groups share one relationship assertion, a grandfather is only
+    kept for people with no attested father.
+
+    The combined query would return one row per combination of values across
+    the groups.  That count is added to stats['combined_rows'], so the rows
+    avoided by joining can be reported.
+
+    :param group_rows: An iterable of (group, rows) in NARROW_QUERIES order,
+        where rows are dicts as returned by flattenBindings(), ordered by ID.
+    :param stats: A dict of counters, updated in place.
+    :return: A list of person rows, exactly one per person, ordered by ID.
+    """
+    people = {}
+    combined_row_counts = {}
+    for group, rows in group_rows:
+        variables = NARROW_QUERIES[group][0]
+        group_values = {}
+        for row in rows:
+            stats['fetched_rows'] += 1
+            values = tuple(row[variable] for variable in variables)
+            group_values.setdefault(row['id'], [])
+            if values not in group_values[row['id']]:
+                group_values[row['id']].append(values)
+
+        for person_id, values_list in group_values.items():
+            if group == 'name':
+                people[person_id] = dict.fromkeys(OUTPUT_KEYS)
+                people[person_id]['id'] = person_id
+                combined_row_counts[person_id] = 1
+            elif person_id not in people:
+                continue
+            elif (group == 'grandfather'
+                  and people[person_id]['fatherID'] is not None):
+                continue
+            if len(values_list) > 1:
+                stats['conflicts'] += 1
+                print(
+                    f'Conflict for person {person_id}: {group} has values '
+                    f'{values_list}; keeping the last.'
+                )
+            combined_row_counts[person_id] *= len(values_list)
+            for variable, value in zip(variables, values_list[-1]):
+                people[person_id][variable] = value
+
+    stats['combined_rows'] += sum(combined_row_counts.values())
+    return sorted(people.values(), key=lambda person: int(person['id']))
+
+
+def fetchNarrowPage(page_filter, stats):
+    """
+    Fetch one page of person data with one query per attribute group, joined
+    by ID.
+
+    :param page_filter: The FILTER clause selecting this page.
+    :param stats: A dict of counters, updated in place.
+    :return: A list of person rows, exactly one per person, ordered by ID.
+    """
+    def groupRows():
+        for group, (variables, pattern) in NARROW_QUERIES.items():
+            group_query = NARROW_QUERY_TEMPLATE.format(
+                variables='\n    '.join(
+                    f'?{variable}' for variable in variables
+                ),
+                pattern=pattern.strip()
+            ).replace(PAGE_FILTER_MARKER, page_filter)
+            yield group, flattenBindings(
+                runQuery(group_query), ['id'] + variables
+            )
+
+    return joinGroups(groupRows(), stats)
+
+
+def dumpGroupRows(graph):
+    """
+    Build the rows each narrow query would return from a DPRR dump.
+
+    :param graph: The rdf_dump.DprrGraph read from the dump.
+    :return: A dict mapping each group in NARROW_QUERIES to its rows, as from
+        flattenBindings(), ordered by ID.
+    """
+    attribute_predicates = {
+        'name': 'hasName',
+        'nomen': 'hasNomen',
+        'cognomen': 'hasCognomen',
+        'highestOffice': 'hasHighestOffice',
+        'birth': 'hasEraFrom',
+        'death': 'hasEraTo'
+    }
+    ancestor_groups = {
+        FATHER_RELATIONSHIP: 'father',
+        GRANDFATHER_RELATIONSHIP: 'grandfather'
+    }
+
+    def isMale(person):
+        return (graph.isA(person, 'Person')
+                and MALE in graph.get(person, 'isSex'))
+
+    triumphators = set()
+    for post_assertion in graph.subjects('PostAssertion'):
+        if TRIUMPHATOR_OFFICE in graph.get(post_assertion, 'hasOffice'):
+            triumphators.update(graph.get(post_assertion, 'isAboutPerson'))
+    # Maps each person to their (group, assertion, related person) ancestor
+    # assertions.
+    ancestors = {}
+    for assertion in graph.subjects('RelationshipAssertion'):
+        for relationship in graph.get(assertion, 'hasRelationship'):
+            if relationship not in ancestor_groups:
+                continue
+            for (person, related_person) in itertools.product(
+                graph.get(assertion, 'isAboutPerson'),
+                graph.get(assertion, 'hasRelatedPerson')
+            ):
+                ancestors.setdefault(person, []).append(
+                    (ancestor_groups[relationship], assertion, related_person)
+                )
+
+    group_rows = {group: [] for group in NARROW_QUERIES}
+    for person in graph.subjects('Person'):
+        if MALE not in graph.get(person, 'isSex'):
+            continue
+        for person_id in graph.get(person, 'hasID'):
+            for group, predicate in attribute_predicates.items():
+                for value in graph.get(person, predicate):
+                    group_rows[group].append({'id': person_id, group: value})
+            if person in triumphators:
+                group_rows['triumphator'].append(
+                    {'id': person_id, 'triumphator': 'True'}
+                )
+            for (group, assertion, related_person) in ancestors.get(
+                person, []
+            ):
+                if not isMale(related_person):
+                    continue
+                (id_variable, uncertain_variable) = NARROW_QUERIES[group][0]
+                for (related_id, is_uncertain) in itertools.product(
+                    graph.get(related_person, 'hasID'),
+                    graph.get(assertion, 'isUncertain') or [None]
+                ):
+                    group_rows[group].append({
+                        'id': person_id,
+                        id_variable: related_id,
+                        uncertain_variable: is_uncertain
+                    })
+    for rows in group_rows.values():
+        rows.sort(key=lambda row: int(row['id']))
+    return group_rows
+
+
+def fetchDumpPage(page_filter, stats):
+    """
+    Read all person data from the DPRR dump, joined by ID as in
+    fetchNarrowPage().
+
+    :param page_filter: Unused. The whole dump is read as one page.
+    :param stats: A dict of counters, updated in place.
+    :return: A list of person rows, exactly one per person, ordered by ID.
+    """
+    group_rows = dumpGroupRows(graph)
+    return joinGroups(
+        ((group, group_rows[group]) for group in NARROW_QUERIES), stats
+    )
+
+
+def loadDump(dump_path):
+    """
+    Read a DPRR RDF dump, reporting how quickly it was parsed.
+
+    :param dump_path: The path of the dump.
+    :return: The rdf_dump.DprrGraph read from the dump.
+    """
+    start = time.perf_counter()
+    dump_graph = rdf_dump.loadGraph(dump_path)
+    elapsed = time.perf_counter() - start
+    print(
+        f'Read {dump_graph.triple_count} triples from {dump_path} in '
+        f'{elapsed:.2f} seconds '
+        f'({dump_graph.triple_count / max(elapsed, 1e-9):.0f} triples/sec).'
+    )
+    return dump_graph
+
+
+def writeServerData(write_path):
+    """
+    Query the server page by page, streaming each page to the output file.
+
+    The output matches a single json.dump of the full list with indent=4.
+    Data is written to a temporary file first so a failed run never leaves
+    a partial file behind.
+
+    :param write_path: The path of the JSON file to write.
+    """
+    if FETCH_STRATEGY == 'narrow':
+        fetchPage = fetchNarrowPage
+        page_filters = getPageFilters()
+    elif FETCH_STRATEGY == 'combined':
+        fetchPage = fetchCombinedPage
+        page_filters = getPageFilters()
+    elif FETCH_STRATEGY == 'dump':
+        fetchPage = fetchDumpPage
+        page_filters = ['']
+    else:
+        raise ValueError(f'Unknown FETCH_STRATEGY {FETCH_STRATEGY}.')
+    stats = {'fetched_rows': 0, 'combined_rows': 0, 'conflicts': 0}
+    temp_path = write_path + '.tmp'
+    row_count = 0
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for page_number, page_filter in enumerate(page_filters, start=1):
+            page_rows = 0
+            for person_dict in fetchPage(page_filter, stats):
+                person_text = json.dumps(
+                    person_dict,
+                    ensure_ascii=False,
+                    indent=4
+                ).replace('\n', '\n    ')
+                f.write(',\n    ' if row_count > 0 else '\n    ')
+                f.write(person_text)
+                row_count += 1
+                page_rows += 1
+            print(f'Page {page_number}: {page_rows} rows.')
+        f.write('\n]' if row_count > 0 else ']')
+    os.replace(temp_path, write_path)
+    print(f'Wrote {row_count} rows to {write_path}.')
+    source = DUMP_PATH if FETCH_STRATEGY == 'dump' else 'the server'
+    print(f'Fetched {stats["fetched_rows"]} rows from {source}.')
+    if FETCH_STRATEGY in ('narrow', 'dump'):
+        avoided_rows = stats['combined_rows'] - row_count
+        print(
+            f'Joined {row_count} rows; the combined query would have returned '
+            f'{stats["combined_rows"]}, avoiding {avoided_rows} duplicates.'
+        )
+        print(f'Found {stats["conflicts"]} conflicting values.')
+
 
-results = requests.get(
-    ENDPOINT,
-    params={'query': query, 'format': 'application/json'}
+client = sparql_client.SparqlClient(
+    ENDPOINT, CACHE_DIR, CACHE_MODE, CACHE_TTL
 )
-# If the server is down, raise an exception and end.
-results.raise_for_status()
-
-results_json = results.json()
-keys = results_json['head']['vars']
-results_json = results_json['results']['bindings']
-
-new_results_json = []
-for person in results_json:
-    person_dict = {}
-    for key in keys:
-        person_key = person.get(key, {'value': None})
-        person_dict[key] = person_key['value']
-    new_results_json.append(person_dict)
-
-with open(WRITE_PATH, 'w', encoding='utf-8') as f:
-    json.dump(new_results_json, f, ensure_ascii=False, indent=4)
+if FETCH_STRATEGY == 'dump':
+    graph = loadDump(DUMP_PATH)
+writeServerData(WRITE_PATH)
@@ -13,20 +13,60 @@ Last Modified: 7/1/2022
 """
 
 # Imports
+import bisect
+import glob
+import hashlib
 import json
+import os
+import time
+
+import numpy as np
+
+import combined_snapshot
 
 # Custom Settings
 START_YEAR = -600  # The first death year to include in the visualization
 FINAL_YEAR = 100   # The last year to include in the visualization
+PERIOD_LENGTH = 25  # The number of years in each block of funerals
+# Also time building one model at a time and compare it to the single pass
+BENCHMARK_MODELS = False
+# Write each person once and each funeral as a list of IDs, without indents
+COMPACT_OUTPUT = False
+# Write each model's time periods to separate files, loaded when in view
+SHARD_OUTPUT = False
+# Reuse funerals from the last run that no changed person could affect
+INCREMENTAL = True
 
 # Globals
 all_people = {}
-all_deaths = []  # Used to sort by death date
+people_table = None  # Columns of people data, from buildPeopleTable
 nomen_dict = {}
+# (person ID, candidate ID) pairs that must never be inferred as father
+# and son.
+impossible_fathers = frozenset()
+# Pairs excluded only when guessing a father from the nomen alone.
+impossible_nomen_fathers = frozenset()
+# People whose father must never be inferred, since their data is impossible.
+no_inference_people = frozenset()
+# (mode, person ID) -> (shared chain of ancestors, number of people walked,
+# chain of the IDs walked)
+lineage_cache = {}
+cyclic_lineages = set()  # (mode, person ID) of walks that hit a data loop
+walk_lengths = {}  # mode -> {number of people walked: number of funerals}
+person_hashes = {}  # person ID -> hash of their data, for incremental runs
+funeral_states = {}  # person ID -> their funeral's walk and people
+rebuilt_blocks = set()  # Blocks of time with funerals walked this run
 
 # Constants and enums
-COMBINED_DATA_PATH = '../json/combined_data.json'
+SERVER_DATA_PATH = '../json/database_data.json'
+SNAPSHOT_PATH = '../json/combined_data.db'  # Binary copy, for fast startup
+OVERRIDE_DATA_PATH = '../json/override_data.json'
 WRITE_PATH = '../js/database_data.js'
+SHARD_PATH = '../js/shards/'  # Where shards are written
+SHARD_URL = 'js/shards/'  # Where funerals.html loads shards from
+STATE_PATH = '../json/generator_state.json'  # Saved for incremental runs
+SEARCH_FILE = 'search_lookups.js'  # Shard holding the search lookups
+CUBE_PATH = '../json/funeral_cube.json'  # Summary for analysis, not the viewer
 ICON_MAP = {
     'consul': 'Praetexta.png',
     'censor': 'Purpurea.png',
@@ -36,9 +76,56 @@ ICON_MAP = {
 CONSERVATIVE = 0
 AGGRESSIVE = 1
 HYPERAGGRESSIVE = 2
+MODELS = (CONSERVATIVE, AGGRESSIVE, HYPERAGGRESSIVE)
+OFFICE_RANKS = ('', 'praetor', 'consul', 'censor', 'triumphator')
+VISIT = 0  # Stack frame actions for walkLineages
+BUILD = 1
+MODEL_NAMES = {
+    CONSERVATIVE: 'conservative',
+    AGGRESSIVE: 'aggressive',
+    HYPERAGGRESSIVE: 'hyperaggressive'
+}
 
 
 # Class definitions
+class BirthIndex():
+    """Contains people sorted by birth year, for finding likely fathers."""
+
+    def __init__(self, people):
+        """
+        Create an index of people by birth year.
+
+        :param people: The people to index, in the order they appear in
+        the data.
+        """
+        # People born in the same year are ranked by their order in the data.
+        ranked = sorted(
+            enumerate(people),
+            key=lambda item: (item[1].birthDate, -item[0])
+        )
+        self.births = [person.birthDate for (order, person) in ranked]
+        self.people = [person for (order, person) in ranked]
+
+    def latestBornBefore(self, year, child_id, excluded_pairs):
+        """
+        Find the person born most recently before a year.
+
+        :param year: Only people born before this year are considered.
+        :param child_id: The ID of the person whose father is being found.
+        :param excluded_pairs: A set of (child ID, candidate ID) pairs
+        that may not be chosen.
+        :return: The latest born person, the first in the data if several
+        were born that year, or None if no one qualifies.
+        """
+        position = bisect.bisect_left(self.births, year)
+        while position > 0:
+            position -= 1
+            candidate = self.people[position]
+            if (child_id, candidate.id) not in excluded_pairs:
+                return candidate
+        return None
+
+
 class Nomen():
     """Contains the name of the nomen and a list of associated people."""
 
@@ -50,6 +137,22 @@ class Nomen():
         """
         self.name = nomen
         self.people = []
+        self.birth_index = None
+        self.cognomen_indexes = {}
+
+    def buildBirthIndexes(self):
+        """
+        Index the people of this nomen by birth year, overall and by
+        cognomen.
+        """
+        self.birth_index = BirthIndex(self.people)
+        people_by_cognomen = {}
+        for person in self.people:
+            people_by_cognomen.setdefault(person.cognomen, []).append(person)
+        self.cognomen_indexes = {
+            cognomen: BirthIndex(people)
+            for cognomen, people in people_by_cognomen.items()
+        }
 
     def __eq__(self, other):
         """
@@ -164,13 +267,58 @@ class Person():
         }
 
 
+class PeopleTable():
+    """Contains people data as NumPy columns, for sorting and grouping."""
+
+    def __init__(self, people):
+        """
+        Create columns from a list of people.
+
+        :param people: The people to include, in the order they appear
+        in the data.
+        """
+        self.ids = np.array([person.id for person in people], dtype=np.int64)
+        self.births = np.array(
+            [person.birthDate for person in people],
+            dtype=np.int64
+        )
+        self.deaths = np.array(
+            [person.deathDate for person in people],
+            dtype=np.int64
+        )
+        # Codes index into nomen_names.
+        (self.nomen_names, self.nomen_codes) = np.unique(
+            [person.nomen for person in people],
+            return_inverse=True
+        )
+        # Ranks index into OFFICE_RANKS.
+        self.office_ranks = np.array(
+            [OFFICE_RANKS.index(person.bestPosition) for person in people],
+            dtype=np.int64
+        )
+        # Filled in by traverseNodes: the block of time of each person's
+        # funeral, or -1 if it is not shown, and the number of people in
+        # each funeral for each model.
+        self.periods = np.full(len(people), -1)
+        self.chain_lengths = {}
+
+
 def parseCombinedDataFile():
-    """Populate global people data based on a JSON file."""
-    with open(COMBINED_DATA_PATH, 'r', encoding='utf-8') as f:
-        data_json = json.load(f)
-    for person_json in data_json:
+    """
+    Populate global people data based on the server data and overrides.
+
+    The data is read from their snapshot, with the overrides applied.  The
+    parts of the snapshot built from a JSON file that has changed are
+    rebuilt first.
+    """
+    people = combined_snapshot.loadPeople(
+        SERVER_DATA_PATH,
+        OVERRIDE_DATA_PATH,
+        SNAPSHOT_PATH
+    )
+    for (person_json, person_hash) in people:
         person = Person(person_json)
-        all_deaths.append((person.id, person.deathDate))
+        person_hashes[person.id] = person_hash
         all_people[person.id] = person
 
         # Set up the nomen dictionary to include this person for fast lookup.
@@ -182,6 +330,32 @@ def parseCombinedDataFile():
             nomen_dict[person.nomen] = nomen
 
 
+def parseExclusions():
+    """
+    Load the impossible father pairs from the override file, along with the
+    people whose father is never inferred.
+    """
+    global impossible_fathers, impossible_nomen_fathers, no_inference_people
+    with open(OVERRIDE_DATA_PATH, 'r', encoding='utf-8') as f:
+        override_json = json.load(f)
+    exclusions = override_json.get('exclusions', [])
+    pairs = [
+        (int(exclusion['id']), int(exclusion['candidate']))
+        for exclusion in exclusions
+        if not exclusion.get('nomenOnly', False)
+    ]
+    nomen_only_pairs = [
+        (int(exclusion['id']), int(exclusion['candidate']))
+        for exclusion in exclusions
+        if exclusion.get('nomenOnly', False)
+    ]
+    impossible_fathers = frozenset(pairs)
+    impossible_nomen_fathers = frozenset(pairs + nomen_only_pairs)
+    no_inference_people = frozenset(
+        int(person_id) for person_id in override_json.get('noInference', [])
+    )
+
+
 def buildNodes():
     """Set up the list of relatives to allow easier access for recursion."""
     for person_id in all_people:
@@ -201,252 +375,474 @@ def buildNodes():
         person = all_people[person_id]
 
 
-def recursiveRoles(mode, index, people_so_far):
+def buildPeopleTable():
+    """Build the NumPy columns used to order and group funerals."""
+    global people_table
+    people_table = PeopleTable(list(all_people.values()))
+
+
+def buildBirthIndexes():
+    """Index each nomen by birth year to speed up finding likely fathers."""
+    for nomen in nomen_dict.values():
+        nomen.buildBirthIndexes()
+
+
+def attestedAncestors(person):
     """
-    Recusrively build data about a person and all their paternal ancestors.
+    Find the ancestor who follows a person without inferring a father.
+
+    :param person: The Person whose ancestor to find
+    :return: The same as nextAncestors, or None if the aggressive models
+    need to infer a father from the person's nomen.
+    """
+    # If a father is attested, it should be used in all cases
+    if person.fatherID is not None:
+        conservative = (True, person.fatherID)
+    else:
+        conservative = (True, person.grandfatherID)
+    if (
+        person.fatherID is not None and
+        (
+            person.relatives[person.fatherID]['certainty'] or
+            person.grandfatherID is None
+            or not person.relatives[person.grandfatherID]['certainty']
+        )
+    ):
+        return (conservative, (True, person.fatherID), (True, person.fatherID))
+
+    # Check if grandfather is attested, it should be used in all cases
+    if person.grandfatherID is not None:
+        attested = (True, person.grandfatherID)
+        return (conservative, attested, attested)
+
+    # If none is attested, the conservative approach would end.
+    # Special cases for people whose data is impossible
+    # (older than their father), listed in the override file
+    if person.id in no_inference_people:
+        return (conservative, (True, None), (True, None))
+
+    # People without a nomen cannot have a father inferred, and are left out.
+    if person.nomen == "":
+        return (conservative, (False, None), (False, None))
+    return None
+
+
+def nextAncestors(person):
+    """
+    Find the ancestor who follows a person in their funeral procession.
 
     Different models will fill gaps in different ways:
     CONSERVATIVE: Do not fill gaps.
     AGGRESSIVE: Fill gaps based on nomen, cognomen, and birth year.
     HYPERAGGRESSIVE: Fill gaps based on nomen and birth year.
 
-    :param mode: The model, CONSERVATIVE or AGGRESSIVE or HYPERAGGRESSIVE
-    :param index: The ID of the person to return info on
-    :param people_so_far: A list of people already considered in this query
-    :return: JSON representing the person and their ancestors.
-    """
-    # Avoid infinite loops caused by bad data
-    if index in people_so_far:
-        print(f'Reached an infinite loop around person with index {index}.')
-        return []
-
-    if all_people.get(index, None) is not None:
-        person = all_people[index]
-        people_so_far.append(index)
-
-        # If a father is attested, it should be used in all cases
-        if (
-            person.fatherID is not None and
-            (
-                mode == CONSERVATIVE or
-                person.relatives[person.fatherID]['certainty'] or
-                person.grandfatherID is None
-                or not person.relatives[person.grandfatherID]['certainty']
+    :param person: The Person whose ancestor to find
+    :return: A tuple with an entry for each model, indexed by the model.
+    Each entry is a tuple of whether the person is part of the procession
+    and the ID of the next ancestor, or None if the procession ends here.
+    """
+    attested = attestedAncestors(person)
+    if attested is not None:
+        return attested
+    # With no father or grandfather, the conservative approach ends here.
+    conservative = (True, None)
+
+    # Search the nomen dictionary.  Find the most likely father
+    # candidate (someone 22+ years older in the same Gens, ideally
+    # with the same cognomen)
+    nomen = nomen_dict.get(person.nomen)
+    # Only fathers born after 600 BCE are considered.
+    bestFit = nomen.cognomen_indexes[person.cognomen].latestBornBefore(
+        person.birthDate - 22,
+        person.id,
+        impossible_fathers
+    )
+    if bestFit is not None and bestFit.birthDate > -600:
+        inferred = (True, bestFit.id)
+        return (conservative, inferred, inferred)
+
+    # Only the hyperaggressive model falls back to the nomen alone.
+    bestFit = nomen.birth_index.latestBornBefore(
+        person.birthDate - 22,
+        person.id,
+        impossible_nomen_fathers
+    )
+    if bestFit is None or bestFit.birthDate <= -600:
+        return (conservative, (True, None), (True, None))
+    return (conservative, (True, None), (True, bestFit.id))
+
+
+def walkLineages(modes, index):
+    """
+    Build data about a person and all their paternal ancestors.
+
+    Lineages are returned as chains of (person JSON, rest of chain) pairs
+    ending in None.  Each ancestor's chain is built once per model and kept
+    in lineage_cache, so descendants share it as their tail instead of
+    rebuilding it.  Chains that run into a loop in the data depend on where
+    the walk started, so they are never cached.
+
+    All of the given models are walked together, and the walk only
+    branches where they disagree about who the next ancestor is.  Models
+    that agree on a whole chain share the same pairs.
+
+    The walk uses a stack instead of recursion, so long chains cannot reach
+    Python's recursion limit.  Each person is first visited, which queues
+    their ancestors, and then built once their ancestors' chains are known.
+
+    :param modes: The models to build, CONSERVATIVE, AGGRESSIVE
+    or HYPERAGGRESSIVE
+    :param index: The ID of the person whose funeral to build
+    :return: A dict from each model to a tuple of the chain representing
+    the person and their ancestors, the number of people walked, and a
+    chain of the IDs of everyone walked, including people not shown.
+    """
+    funeral = {}
+    stack = [(VISIT, modes, index, [], set(), funeral)]
+    while len(stack) > 0:
+        frame = stack.pop()
+        if frame[0] == BUILD:
+            buildLineages(*frame[1:])
+            continue
+        (action, modes, index, path, visited, results) = frame
+
+        # Avoid infinite loops caused by bad data
+        if index in visited:
+            model_names = ', '.join(MODEL_NAMES[mode] for mode in modes)
+            loop = path[path.index(index):] + [index]
+            print(
+                f'Reached an infinite loop around person with index {index} '
+                f'({model_names}): ' +
+                ' -> '.join(str(person_id) for person_id in loop)
+            )
+            cyclic_lineages.update(
+                (mode, person_id) for mode in modes for person_id in path
+            )
+            results.update(dict.fromkeys(modes, (None, 0, None)))
+            continue
+
+        # The person whose funeral it is appears even without a position.
+        is_funeral = len(path) == 0
+        lineages = {}
+        remaining_modes = []
+        for mode in modes:
+            if not is_funeral and (mode, index) in lineage_cache:
+                lineages[mode] = lineage_cache[(mode, index)]
+            else:
+                remaining_modes.append(mode)
+        person = all_people.get(index, None)
+        if len(remaining_modes) == 0 or person is None:
+            # Walks to missing people are kept, in case they are added later.
+            lineages.update(
+                dict.fromkeys(remaining_modes, (None, 0, (index, None)))
             )
+            results.update(lineages)
+            continue
+        path.append(index)
+        visited.add(index)
+
+        # Group the models by the ancestor each one follows.
+        next_ancestors = nextAncestors(person)
+        branches = {}
+        for mode in remaining_modes:
+            branches.setdefault(next_ancestors[mode], []).append(mode)
+
+        ancestors = {}
+        stack.append(
+            (BUILD, person, branches, ancestors, lineages, is_funeral, results)
+        )
+        # Reversed, so branches are walked in order off the stack.
+        for ((is_shown, ancestor_id), branch_modes) in reversed(
+            list(branches.items())
         ):
-            # Do not include people without political positions
-            # unless it is their funeral: len(people_so_far) == 1
-            if person.bestPosition == '' and len(people_so_far) != 1:
-                return recursiveRoles(mode, person.fatherID, people_so_far)
+            if not is_shown or ancestor_id is None:
+                continue
+            # Each branch needs its own path to check for loops.
+            if len(branches) > 1:
+                stack.append((
+                    VISIT, branch_modes, ancestor_id,
+                    list(path), set(visited), ancestors
+                ))
             else:
-                return [person.getFuneralJSON()] + recursiveRoles(
-                    mode,
-                    person.fatherID,
-                    people_so_far
-                )
-        else:
-            # Check if grandfather is attested, it should be used in all cases
-            if person.grandfatherID is not None:
-                if person.bestPosition == '' and len(people_so_far) != 1:
-                    return recursiveRoles(
-                        mode,
-                        person.grandfatherID,
-                        people_so_far
-                    )
-                else:
-                    return [person.getFuneralJSON()] + recursiveRoles(
-                        mode,
-                        person.grandfatherID,
-                        people_so_far
-                    )
-
-            # If none is attested, the conservative approach would end.
-            # Special cases for people whose data is impossible
-            # (older than their father)
-            # TODO: Make these exceptions more general,
-            # since they can be overridden manually.
-            if (
-                mode == CONSERVATIVE or index in [1095, 1032, 1235, 4695]
-            ):
-                if person.bestPosition == '' and len(people_so_far) != 1:
-                    return []
-                else:
-                    return [person.getFuneralJSON()]
+                stack.append((
+                    VISIT, branch_modes, ancestor_id, path, visited, ancestors
+                ))
+    return funeral
+
+
+def buildLineages(person, branches, ancestors, lineages, is_funeral, results):
+    """
+    Build a person's chains once their ancestors' chains are known.
+
+    :param person: The Person to build chains for
+    :param branches: A dict from (is shown, ancestor ID) to the models
+    following that ancestor, from nextAncestors
+    :param ancestors: A dict from each model to the ancestor's chain,
+    walk length and walk
+    :param lineages: A dict of chains already found, which is added to
+    :param is_funeral: Whether this is the person whose funeral it is
+    :param results: The dict to add the person's chains to
+    """
+    for ((is_shown, ancestor_id), branch_modes) in branches.items():
+        # Models with the same ancestors share one chain.
+        chains_by_tail = {}
+        for mode in branch_modes:
+            (tail, tail_length, tail_walk) = ancestors.get(
+                mode,
+                (None, 0, None)
+            )
+            walk = (person.id, tail_walk)
+            if not is_shown:
+                chain = None
+                lineage = None
             else:
-                # Search the nomen dictionary.  Find the most likely father
-                # candidate (someone 22+ years older in the same Gens, ideally
-                # with the same cognomen)
-                personNomen = person.nomen
-                if personNomen != "":
-                    nomen = nomen_dict.get(personNomen)
-                    sameCognomen = []
-                    sameNomen = []
-                    for x in nomen.people:
-                        # Special cases for people whose data is impossible.
-                        # TODO: Build dynamically in case data is edited.
-                        if (
-                            x.cognomen == person.cognomen and
-                            x.birthDate < person.birthDate - 22 and
-                            (index != 3264 or x.id != 3957) and
-                            (index != 3264 or x.id != 3956) and
-                            (index != 4453 or x.id != 5311) and
-                            (index != 5297 or x.id != 4116) and
-                            (index != 5297 or x.id != 4118) and
-                            (index != 3788 or x.id != 3573) and
-                            (index != 3349 or x.id != 624) and
-                            (index != 1235 or x.id != 1032) and
-                            (index != 4026 or x.id != 4093)
-                        ):
-                            sameCognomen.append(x)
-                        if (
-                            x.birthDate < person.birthDate - 22 and
-                            (index != 3264 or x.id != 3957) and
-                            (index != 3264 or x.id != 3956) and
-                            (index != 4453 or x.id != 5311) and
-                            (index != 5297 or x.id != 4116) and
-                            (index != 5297 or x.id != 4118) and
-                            (index != 3788 or x.id != 3573) and
-                            (index != 3349 or x.id != 580) and
-                            (index != 3349 or x.id != 624) and
-                            (index != 1235 or x.id != 1032) and
-                            (index != 4026 or x.id != 4093)
-                        ):
-                            sameNomen.append(x)
-                    bestFitId = 0
-                    bestFitBirth = -600
-                    for x in sameCognomen:
-                        if x.birthDate > bestFitBirth:
-                            bestFitBirth = x.birthDate
-                            bestFitId = x.id
-                    if len(sameCognomen) == 0 or bestFitId == 0:
-                        bestFitId = 0
-                        bestFitBirth = -600
-                        for x in sameNomen:
-                            if x.birthDate > bestFitBirth:
-                                bestFitBirth = x.birthDate
-                                bestFitId = x.id
-                        if (
-                            len(sameNomen) == 0 or
-                            bestFitId == 0 or
-                            not(mode == HYPERAGGRESSIVE)
-                        ):
-                            if (
-                                person.bestPosition == '' and
-                                len(people_so_far) != 1
-                            ):
-                                return []
-                            else:
-                                return [person.getFuneralJSON()]
-                        else:
-                            if (
-                                person.bestPosition == '' and
-                                len(people_so_far) != 1
-                            ):
-                                return recursiveRoles(
-                                    mode,
-                                    bestFitId,
-                                    people_so_far
-                                )
-                            else:
-                                return [person.getFuneralJSON()] +  \
-                                    recursiveRoles(
-                                        mode,
-                                        bestFitId,
-                                        people_so_far
-                                    )
-                    else:
-                        if (
-                            person.bestPosition == '' and
-                            len(people_so_far) != 1
-                        ):
-                            return recursiveRoles(
-                                mode,
-                                bestFitId,
-                                people_so_far
-                            )
-                        else:
-                            return [person.getFuneralJSON()] + recursiveRoles(
-                                mode,
-                                bestFitId,
-                                people_so_far
-                            )
-    return []
-
-
-def sortDates():
-    """Sort people by death date."""
-    for indexOne in range(0, len(all_deaths) - 1):
-        for indexTwo in range(indexOne + 1, len(all_deaths)):
-            if all_deaths[indexOne][1] > all_deaths[indexTwo][1]:
-                temp = all_deaths[indexOne]
-                all_deaths[indexOne] = all_deaths[indexTwo]
-                all_deaths[indexTwo] = temp
-
-
-def traverseNodes(mode):
+                if id(tail) not in chains_by_tail:
+                    chains_by_tail[id(tail)] = (person.getFuneralJSON(), tail)
+                chain = chains_by_tail[id(tail)]
+                # Do not include people without political positions
+                # unless it is their funeral
+                lineage = tail if person.bestPosition == '' else chain
+
+            if (mode, person.id) not in cyclic_lineages:
+                lineage_cache[(mode, person.id)] = (
+                    lineage,
+                    tail_length + 1,
+                    walk
+                )
+            lineages[mode] = (
+                chain if is_funeral else lineage,
+                tail_length + 1,
+                walk
+            )
+    results.update(lineages)
+
+
+def chainToList(chain):
+    """
+    Convert a lineage or walk chain from walkLineages to a list.
+
+    :param chain: A chain of (person JSON or ID, rest of chain) pairs.
+    :return: A list of the person JSON or IDs in the chain, in order.
+    """
+    funeral = []
+    while chain is not None:
+        (person_json, chain) = chain
+        funeral.append(person_json)
+    return funeral
+
+
+def periodName(period_start):
+    """
+    Name a block of time, such as '600–576 BCE'.
+
+    :param period_start: The first year of the block.
+    :return: The name shown for the block.
+    """
+    # Subtracting 1 gives the last year of the block.
+    period_end = period_start + PERIOD_LENGTH - 1
+    return f'{abs(period_start)}' + \
+        f'–{abs(period_end)} ' + \
+        f'{"CE" if period_end >= 0 else "BCE"}'
+
+
+def periodJSON(period_start, funerals):
+    """
+    Build the JSON for one block of time.
+
+    :param period_start: The first year of the block.
+    :param funerals: The funerals in the block, in order.
+    :return: A JSON object with the block's name and its funerals.
+    """
+    return {
+        'timePeriod': periodName(period_start),
+        'funerals': funerals
+    }
+
+
+def traverseNodes(modes, reusable_funerals=None):
     """
     Produce the lineage history for all people, sorted by death date.
 
-    :param mode: The model, CONSERVATIVE or AGGRESSIVE or HYPERAGGRESSIVE
-    :return: A JSON object representing each person's funeral lineage data.
+    Every model is built in the same pass over the people.  Funerals are
+    grouped into blocks of PERIOD_LENGTH years from START_YEAR, and within
+    each block are ordered from most ancestors to fewest, then by death date.
+    The state of each funeral is kept in funeral_states for saveState.
+
+    :param modes: The models to build, CONSERVATIVE, AGGRESSIVE
+    or HYPERAGGRESSIVE
+    :param reusable_funerals: A dict from person ID to a funeral state from
+    the previous run that does not need to be walked again, or None.
+    :return: A dict from each model to a JSON object representing each
+    person's funeral lineage data.
     """
-    sortDates()
-    all_funerals = []
+    deaths = people_table.deaths
+    rows = np.flatnonzero((deaths >= START_YEAR) & (deaths <= FINAL_YEAR))
+    rows = rows[np.argsort(deaths[rows], kind='stable')]
     # Create blocks of 25 year periods.
-    current_period_funerals = []
-    current_period_start = -600
-    # Adding 24 gives a 25 year range.
-    current_period_end = current_period_start + 24
-    for death in all_deaths:
-        person_id = death[0]
-        death_year = death[1]
-        if death_year < START_YEAR:
+    period_edges = np.arange(
+        START_YEAR,
+        FINAL_YEAR + PERIOD_LENGTH + 1,
+        PERIOD_LENGTH
+    )
+    periods = np.digitize(deaths[rows], period_edges) - 1
+    people_table.periods = np.full(len(people_table.ids), -1)
+    people_table.periods[rows] = periods
+
+    funerals = {mode: [] for mode in modes}
+    for mode in modes:
+        walk_lengths[mode] = {}
+    funeral_states.clear()
+    rebuilt_blocks.clear()
+    for (person_id, period) in zip(people_table.ids[rows], periods):
+        person_id = int(person_id)
+        if reusable_funerals is not None and person_id in reusable_funerals:
+            state = reusable_funerals[person_id]
+            for mode in modes:
+                (funeral_ids, walk_length) = state['models'][MODEL_NAMES[mode]]
+                walk_lengths[mode][walk_length] = \
+                    walk_lengths[mode].get(walk_length, 0) + 1
+                funerals[mode].append([
+                    all_people[funeral_id].getFuneralJSON()
+                    for funeral_id in funeral_ids
+                ])
+            funeral_states[person_id] = state
             continue
-        if death_year > FINAL_YEAR:
-            break
-        # Advance to the next block of time.
-        while death_year > current_period_start + 24:
-            if len(current_period_funerals) > 0:
-                current_period_funerals = sortFuneralsBySize(
-                    current_period_funerals
-                )
-                all_funerals.append({
-                    'timePeriod': f'{abs(current_period_start)}' +
-                    f'–{abs(current_period_end)} ' +
-                    f'{"CE" if current_period_end >= 0 else "BCE"}',
-                    'funerals': current_period_funerals
-                })
-            current_period_funerals = []
-            current_period_start += 25
-            current_period_end += 25
-        person_funeral_json = recursiveRoles(mode, person_id, [])
-        current_period_funerals.append(person_funeral_json)
-    # Include the final block of funerals.
-    if len(current_period_funerals) > 0:
-        current_period_funerals = sortFuneralsBySize(current_period_funerals)
-        all_funerals.append({
-            'timePeriod': f'{abs(current_period_start)}' +
-            f'–{abs(current_period_end)} ' +
-            f'{"CE" if current_period_end >= 0 else "BCE"}',
-            'funerals': current_period_funerals
-        })
-    return {'timePeriods': all_funerals}
-
-
-def sortFuneralsBySize(funerals):
-    """
-    Sort the funerals in a time block from most ancestors to fewest.
-
-    :param funerals: A list of funerals to order by length.
-    :return: The list of funerals ordered by number of ancestors.
-    """
-    for ii in range(0, len(funerals) - 1):
-        for jj in range(ii + 1, len(funerals)):
-            if len(funerals[ii]) < len(funerals[jj]):
-                temp = funerals[ii]
-                funerals[ii] = funerals[jj]
-                funerals[jj] = temp
-    return funerals
+
+        rebuilt_blocks.add(int(period))
+        lineages = walkLineages(modes, person_id)
+        walked = set()
+        state = {'block': int(period), 'models': {}}
+        for mode in modes:
+            (chain, walk_length, walk) = lineages[mode]
+            walk_lengths[mode][walk_length] = \
+                walk_lengths[mode].get(walk_length, 0) + 1
+            funeral = chainToList(chain)
+            funerals[mode].append(funeral)
+            walked.update(chainToList(walk))
+            state['models'][MODEL_NAMES[mode]] = (
+                [person_json['id'] for person_json in funeral],
+                walk_length
+            )
+        state['walked'] = sorted(walked)
+        funeral_states[person_id] = state
+
+    data = {}
+    for mode in modes:
+        lengths = np.array([len(funeral) for funeral in funerals[mode]])
+        people_table.chain_lengths[mode] = np.zeros(
+            len(people_table.ids),
+            dtype=np.int64
+        )
+        people_table.chain_lengths[mode][rows] = lengths
+        # Order by block, then from most ancestors to fewest, then by death.
+        order = np.lexsort((np.arange(len(rows)), -lengths, periods))
+        (period_numbers, starts) = np.unique(
+            periods[order],
+            return_index=True
+        )
+        ends = np.append(starts[1:], len(order))
+        all_funerals = []
+        for (period, start, end) in zip(period_numbers, starts, ends):
+            all_funerals.append(periodJSON(
+                START_YEAR + int(period) * PERIOD_LENGTH,
+                [funerals[mode][funeral] for funeral in order[start:end]]
+            ))
+        data[mode] = {'timePeriods': all_funerals}
+    return data
+
+
+def periodStatistics(mode):
+    """
+    Summarize the funerals in each block of time for a model.
+
+    Uses the funerals from the last call to traverseNodes.
+
+    :param mode: The model, CONSERVATIVE or AGGRESSIVE or HYPERAGGRESSIVE
+    :return: A tuple of arrays with the block number, the number of
+    funerals, the number of people in them, and the most people in one
+    funeral, for each block of time with funerals, in order.
+    """
+    in_range = people_table.periods >= 0
+    lengths = people_table.chain_lengths[mode][in_range]
+    (period_numbers, period_rows) = np.unique(
+        people_table.periods[in_range],
+        return_inverse=True
+    )
+    funeral_counts = np.bincount(period_rows)
+    person_counts = np.bincount(period_rows, weights=lengths).astype(np.int64)
+    longest = np.zeros(len(period_numbers), dtype=np.int64)
+    np.maximum.at(longest, period_rows, lengths)
+    return (period_numbers, funeral_counts, person_counts, longest)
+
+
+def buildFuneralCube():
+    """
+    Summarize the funerals by block of time, best position and nomen.
+
+    Uses the funerals from the last call to traverseNodes.  Each cell of the
+    cube is a row of codes into its lists of time periods, positions and
+    gentes, followed by the funeral count, mean procession length and
+    longest procession for each model.  Empty cells are left out.
+
+    :return: A JSON object with the cube's labels and rows.
+    """
+    in_range = np.flatnonzero(people_table.periods >= 0)
+    period_count = (FINAL_YEAR - START_YEAR) // PERIOD_LENGTH + 1
+    dims = (period_count, len(OFFICE_RANKS), len(people_table.nomen_names))
+    cells = np.ravel_multi_index((
+        people_table.periods[in_range],
+        people_table.office_ranks[in_range],
+        people_table.nomen_codes[in_range]
+    ), dims)
+    (cell_numbers, cell_rows) = np.unique(cells, return_inverse=True)
+    columns = list(np.unravel_index(cell_numbers, dims))
+    funeral_counts = np.bincount(cell_rows)
+    columns.append(funeral_counts)
+    for mode in MODELS:
+        lengths = people_table.chain_lengths[mode][in_range]
+        person_counts = np.bincount(cell_rows, weights=lengths)
+        longest = np.zeros(len(cell_numbers), dtype=np.int64)
+        np.maximum.at(longest, cell_rows, lengths)
+        columns.append(np.round(person_counts / funeral_counts, 2))
+        columns.append(longest)
+    return {
+        'timePeriods': [
+            periodName(START_YEAR + period * PERIOD_LENGTH)
+            for period in range(period_count)
+        ],
+        'positions': list(OFFICE_RANKS),
+        'gentes': people_table.nomen_names.tolist(),
+        'columns': ['timePeriod', 'position', 'gens', 'funeralCount'] + [
+            f'{MODEL_NAMES[mode]}{statistic}'
+            for mode in MODELS
+            for statistic in ['MeanLength', 'MaxLength']
+        ],
+        'rows': [list(row) for row in zip(*[
+            column.tolist() for column in columns
+        ])]
+    }
+
+
+def benchmarkModels():
+    """Time building the models in one pass against one pass per model."""
+    timings = []
+    for passes in [[(mode,) for mode in MODELS], [MODELS]]:
+        lineage_cache.clear()
+        cyclic_lineages.clear()
+        start = time.perf_counter()
+        data = {}
+        for modes in passes:
+            data.update(traverseNodes(modes))
+        timings.append((time.perf_counter() - start, data))
+    ((separate_seconds, separate_data), (single_seconds, single_data)) = \
+        timings
+    print(
+        f'One pass per model: {separate_seconds:.3f}s, '
+        f'single pass: {single_seconds:.3f}s, '
+        f'same output: {separate_data == single_data}'
+    )
+    lineage_cache.clear()
+    cyclic_lineages.clear()
 
 
 def buildDropdownLookup():
@@ -476,33 +872,416 @@ def buildGensLookup():
     return gens_json
 
 
+def printWalkLengths():
+    """Print how many people each model walked through for each funeral."""
+    for mode in MODELS:
+        counts = walk_lengths.get(mode, {})
+        histogram = ', '.join(
+            f'{walk_length}: {counts[walk_length]}'
+            for walk_length in sorted(counts)
+        )
+        print(f'{MODEL_NAMES[mode]} walk lengths (people: funerals): '
+              f'{histogram}')
+
+
+def contentHashes():
+    """
+    Hash each person's data together with their impossible fathers and
+    whether their father may be inferred.
+
+    :return: A dict from person ID to a hash of everything about them that
+    can change their funeral or the funerals that pass through them.
+    """
+    exclusions = {}
+    for (person_id, candidate_id) in sorted(impossible_nomen_fathers):
+        exclusions.setdefault(person_id, []).append(
+            [candidate_id, (person_id, candidate_id) in impossible_fathers]
+        )
+    return {
+        person_id: hashlib.sha1(
+            (person_hash + json.dumps([
+                exclusions.get(person_id, []),
+                person_id in no_inference_people
+            ]))
+            .encode('utf-8')
+        ).hexdigest()
+        for (person_id, person_hash) in person_hashes.items()
+    }
+
+
+def stateSettings():
+    """
+    Get everything besides the data that the saved state depends on.
+
+    :return: A JSON object of the settings and a hash of this script, so
+    changing either forces a full rebuild.
+    """
+    with open(__file__, 'rb') as f:
+        generator_hash = hashlib.sha1(f.read()).hexdigest()
+    return {
+        'generator': generator_hash,
+        'startYear': START_YEAR,
+        'finalYear': FINAL_YEAR,
+        'periodLength': PERIOD_LENGTH,
+        'compactOutput': COMPACT_OUTPUT,
+        'shardOutput': SHARD_OUTPUT
+    }
+
+
+def loadState():
+    """
+    Load the state saved by the last run.
+
+    :return: The saved state, or None if there is none or it was saved with
+    other settings.
+    """
+    if not os.path.exists(STATE_PATH):
+        return None
+    with open(STATE_PATH, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    if state.get('settings') != stateSettings():
+        return None
+    return state
+
+
+def saveState(hashes):
+    """
+    Save the funerals from this run so the next run can reuse them.
+
+    :param hashes: The content hashes from contentHashes.
+    """
+    state = {
+        'settings': stateSettings(),
+        'people': {
+            str(person_id): [hashes[person_id], person.nomen]
+            for (person_id, person) in all_people.items()
+        },
+        'funerals': {
+            str(person_id): funeral_state
+            for (person_id, funeral_state) in funeral_states.items()
+        }
+    }
+    with open(STATE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+
+
+def findReusableFunerals(state, hashes):
+    """
+    Find the saved funerals that no changed person could affect.
+
+    A person is changed if their hash differs from the saved one, or they
+    were added or removed.  A changed person can also change the father
+    inferred for anyone else with the same nomen, so the people of that
+    nomen whose fathers are inferred are treated as changed too.  Every
+    funeral whose walk passed through a changed person is rebuilt, found
+    with a reverse index from each person to the funerals that walked
+    through them.
+
+    :param state: The state saved by the last run, from loadState.
+    :param hashes: The content hashes from contentHashes.
+    :return: A tuple of a dict from person ID to their reusable funeral
+    state, and the set of blocks of time that lost a rebuilt funeral.
+    """
+    saved_people = state['people']
+    changed = set()
+    changed_nomens = set()
+    for (person_id, person) in all_people.items():
+        saved = saved_people.get(str(person_id), None)
+        if saved is None or saved[0] != hashes[person_id]:
+            changed.add(person_id)
+            changed_nomens.add(person.nomen)
+            if saved is not None:
+                changed_nomens.add(saved[1])
+    for (person_id, (saved_hash, saved_nomen)) in saved_people.items():
+        if int(person_id) not in all_people:
+            changed.add(int(person_id))
+            changed_nomens.add(saved_nomen)
+    for nomen in changed_nomens:
+        if nomen in nomen_dict:
+            changed.update(
+                person.id
+                for person in nomen_dict[nomen].people
+                if attestedAncestors(person) is None
+            )
+
+    funerals_through = {}
+    for (person_id, funeral_state) in state['funerals'].items():
+        for walked_id in funeral_state['walked']:
+            funerals_through.setdefault(walked_id, []).append(int(person_id))
+    affected = set()
+    for person_id in changed:
+        affected.update(funerals_through.get(person_id, []))
+
+    reusable = {}
+    stale_blocks = set()
+    for (person_id, funeral_state) in state['funerals'].items():
+        if int(person_id) in affected:
+            stale_blocks.add(funeral_state['block'])
+        else:
+            reusable[int(person_id)] = funeral_state
+    print(
+        f'{len(changed)} people changed or may have a new inferred father; '
+        f'rebuilding {len(affected)} of {len(state["funerals"])} '
+        f'saved funerals.'
+    )
+    return (reusable, stale_blocks)
+
+
+def buildFuneralIndexes(data):
+    """
+    Build inverted indexes from people and gentes to their funerals.
+
+    Funerals are identified as '<time period>_<funeral>', the positions
+    given to their groups by the visualization as funeralEra and
+    funeralNumber.
+
+    :param data: A dict from each model to its funeral lineage data,
+    from traverseNodes.
+    :return: A JSON object with, for each model, a dict from each person ID
+    and a dict from each nomen to the funerals that include them.
+    """
+    indexes = {}
+    for (mode, model_data) in data.items():
+        people = {}
+        gens = {}
+        for (era, period) in enumerate(model_data['timePeriods']):
+            for (number, funeral) in enumerate(period['funerals']):
+                funeral_id = f'{era}_{number}'
+                for person_json in funeral:
+                    for (index, key) in [
+                        (people, str(person_json['id'])),
+                        (gens, person_json['nomen'])
+                    ]:
+                        funeral_ids = index.setdefault(key, [])
+                        # Each funeral is listed once per person or gens.
+                        if funeral_ids[-1:] != [funeral_id]:
+                            funeral_ids.append(funeral_id)
+        indexes[MODEL_NAMES[mode]] = {'people': people, 'gens': gens}
+    return indexes
+
+
+def compactPeriod(period):
+    """
+    Replace each person in a time period's funerals with their ID.
+
+    :param period: A time period's JSON, from periodJSON.
+    :return: A tuple of a dict from each person's ID to their JSON, and the
+    time period with each funeral as a list of person IDs.
+    """
+    people = {}
+    funerals = []
+    for funeral in period['funerals']:
+        for person_json in funeral:
+            people[person_json['id']] = person_json
+        funerals.append([person_json['id'] for person_json in funeral])
+    return (people, {'timePeriod': period['timePeriod'], 'funerals': funerals})
+
+
+def compactFuneralData(data):
+    """
+    Replace each person in the funerals with their ID.
+
+    :param data: A dict from each model to its funeral lineage data,
+    from traverseNodes.
+    :return: A tuple of a dict from each person's ID to their JSON, and a
+    dict from each model to its funerals as lists of person IDs.
+    """
+    people = {}
+    compact_data = {}
+    for (mode, model_data) in data.items():
+        time_periods = []
+        for period in model_data['timePeriods']:
+            (period_people, compact_period) = compactPeriod(period)
+            people.update(period_people)
+            time_periods.append(compact_period)
+        compact_data[mode] = {'timePeriods': time_periods}
+    return (people, compact_data)
+
+
+def jsonOptions():
+    """
+    Get the json.dump options for the output format.
+
+    :return: A dict of keyword arguments for json.dump.
+    """
+    if COMPACT_OUTPUT:
+        return {'ensure_ascii': False, 'separators': (',', ':')}
+    return {'ensure_ascii': False, 'indent': 4}
+
+
+def writeConstant(f, name, value):
+    """
+    Write a JS constant holding JSON data.
+
+    :param f: The file to write to.
+    :param name: The name of the constant.
+    :param value: The JSON data to assign to it.
+    """
+    f.write(f"\nconst {name} =\n")
+    json.dump(value, f, **jsonOptions())
+    f.write(";\n")
+
+
+def writeJSFile(path, function_name, args, value):
+    """
+    Write a JS file that passes JSON data to a function as it loads.
+
+    :param path: The path of the file to write.
+    :param function_name: The name of the function to call.
+    :param args: A list of the JS source of the arguments before the data.
+    :param value: The JSON data to pass last.
+    """
+    call = f"{function_name}(" + ''.join(f'{arg}, ' for arg in args)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("// File automatically generated by Python script.\n\n")
+        f.write(call.rstrip() + "\n")
+        json.dump(value, f, **jsonOptions())
+        f.write(");\n")
+
+
+def writeShards(data, indexes, blocks_to_write=None):
+    """
+    Write each model's time periods and funeral index, and the search
+    lookups, to their own JS files.
+
+    The viewer loads a shard only when its model is selected and its time
+    period is in view, loads a model's index along with its shards, and
+    loads the search lookups when a search box is first used.  Shards are
+    named by their block of time, so a block that did not change
+    keeps its file.  Shards for blocks that no longer have funerals are
+    removed.
+
+    :param data: A dict from each model to its funeral lineage data,
+    from traverseNodes.
+    :param indexes: The funeral indexes, from buildFuneralIndexes.
+    :param blocks_to_write: The blocks of time to write, or None for all.
+    Shards that do not exist yet are always written.
+    :return: A JSON manifest listing each model's shards with their counts,
+    each model's index file, and the search lookups file.
+    """
+    os.makedirs(SHARD_PATH, exist_ok=True)
+    manifest = {
+        'directory': SHARD_URL,
+        'models': {},
+        'indexes': {},
+        'searchLookups': SEARCH_FILE
+    }
+    search_path = os.path.join(SHARD_PATH, SEARCH_FILE)
+    shard_files = {os.path.normpath(search_path)}
+    writeJSFile(search_path, 'registerSearchLookups', [], {
+        'people': buildDropdownLookup(),
+        'gens': buildGensLookup()
+    })
+    written = 0
+    for (mode, model_data) in data.items():
+        # Every run may number the funerals differently, so the index is
+        # always written.
+        file_name = f'{MODEL_NAMES[mode]}_index.js'
+        index_path = os.path.join(SHARD_PATH, file_name)
+        shard_files.add(os.path.normpath(index_path))
+        writeJSFile(
+            index_path,
+            'registerFuneralIndex',
+            [f"'{MODEL_NAMES[mode]}'"],
+            indexes[MODEL_NAMES[mode]]
+        )
+        manifest['indexes'][MODEL_NAMES[mode]] = file_name
+        shards = []
+        (blocks, funeral_counts, person_counts, longest) = \
+            periodStatistics(mode)
+        for (index, period) in enumerate(model_data['timePeriods']):
+            block = int(blocks[index])
+            file_name = f'{MODEL_NAMES[mode]}_{block}.js'
+            shard_path = os.path.join(SHARD_PATH, file_name)
+            shard_files.add(os.path.normpath(shard_path))
+            if (
+                blocks_to_write is None or
+                block in blocks_to_write or
+                not os.path.exists(shard_path)
+            ):
+                shard_json = period
+                if COMPACT_OUTPUT:
+                    (people, shard_json) = compactPeriod(period)
+                    shard_json['people'] = people
+                writeJSFile(
+                    shard_path,
+                    'registerFuneralShard',
+                    [f"'{MODEL_NAMES[mode]}'", str(block)],
+                    shard_json
+                )
+                written += 1
+            shards.append({
+                'timePeriod': period['timePeriod'],
+                'block': block,
+                'file': file_name,
+                'funeralCount': int(funeral_counts[index]),
+                'personCount': int(person_counts[index]),
+                'maxFuneralLength': int(longest[index])
+            })
+        manifest['models'][MODEL_NAMES[mode]] = shards
+    for old_shard in glob.glob(os.path.join(SHARD_PATH, '*_*.js')):
+        if os.path.normpath(old_shard) not in shard_files:
+            os.remove(old_shard)
+    print(f'Wrote {written} shards to {SHARD_PATH}.')
+    return manifest
+
+
 def buildFuneralDataFile(write_file):
     """
     Write a JS file containing funeral data for visualizations.
 
     :param write_file: The path of the file to write.
     """
+    hashes = contentHashes()
+    state = loadState() if INCREMENTAL else None
+    if state is None:
+        data = traverseNodes(MODELS)
+        blocks_to_write = None
+    else:
+        (reusable_funerals, stale_blocks) = findReusableFunerals(
+            state,
+            hashes
+        )
+        data = traverseNodes(MODELS, reusable_funerals)
+        blocks_to_write = stale_blocks | rebuilt_blocks
+    indexes = buildFuneralIndexes(data)
     with open(write_file, 'w', encoding='utf-8') as f:
-        f.write("// File automatically generated by Python script.\n\n")
-        f.write("const conservativeFuneralData =\n")
-        data = traverseNodes(CONSERVATIVE)
-        json.dump(data, f, ensure_ascii=False, indent=4)
-        f.write(";\n\nconst aggressiveFuneralData =\n")
-        data = traverseNodes(AGGRESSIVE)
-        json.dump(data, f, ensure_ascii=False, indent=4)
-        f.write(";\n\nconst hyperaggressiveFuneralData =\n")
-        data = traverseNodes(HYPERAGGRESSIVE)
-        json.dump(data, f, ensure_ascii=False, indent=4)
-        f.write(";\n\nconst autocompleteJSON =\n")
-        lookup = buildDropdownLookup()
-        json.dump(lookup, f, ensure_ascii=False, indent=4)
-        f.write(";\n\nconst gensJSON =\n")
-        lookup = buildGensLookup()
-        json.dump(lookup, f, ensure_ascii=False, indent=4)
-        f.write(";\n")
+        f.write("// File automatically generated by Python script.\n")
+        if SHARD_OUTPUT:
+            writeConstant(
+                f,
+                'funeralManifest',
+                writeShards(data, indexes, blocks_to_write)
+            )
+        else:
+            if COMPACT_OUTPUT:
+                (people, data) = compactFuneralData(data)
+                writeConstant(f, 'funeralPeople', people)
+            writeConstant(f, 'conservativeFuneralData', data[CONSERVATIVE])
+            writeConstant(f, 'aggressiveFuneralData', data[AGGRESSIVE])
+            writeConstant(
+                f,
+                'hyperaggressiveFuneralData',
+                data[HYPERAGGRESSIVE]
+            )
+            writeConstant(f, 'funeralIndexes', indexes)
+            writeConstant(f, 'autocompleteJSON', buildDropdownLookup())
+            writeConstant(f, 'gensJSON', buildGensLookup())
+    print(f'Wrote {os.path.getsize(write_file)} bytes to {write_file}.')
+    with open(CUBE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(buildFuneralCube(), f, **jsonOptions())
+    # Saved last, so an interrupted write is redone by the next run.
+    if INCREMENTAL:
+        saveState(hashes)
 
 
 # Build the people objects, then run the program.
 parseCombinedDataFile()
+parseExclusions()
 buildNodes()
+buildBirthIndexes()
+buildPeopleTable()
+if BENCHMARK_MODELS:
+    benchmarkModels()
 buildFuneralDataFile(WRITE_PATH)
+printWalkLengths()
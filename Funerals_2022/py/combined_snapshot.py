@@ -0,0 +1,240 @@
+"""
+Keeps a binary snapshot of the person data, so the generator can start
+without parsing JSON.
+
+The snapshot is an SQLite file.  Its person table holds the rows of
+json/database_data.json, in order, along with a hash of each person's JSON for
+incremental runs.  Its override table holds the manual overrides from
+json/override_data.json, one row per (id, field).  The overrides are applied
+as the people are read, giving the same data that json/combined_data.json
+holds, so the merged data never needs to be written out.
+
+The snapshot records a hash of each JSON file it was built from.  When a file
+changes, only the table built from it is rebuilt, so editing an override does
+not reload the server data.
+"""
+
+# Imports
+import hashlib
+import json
+import os
+import sqlite3
+
+# Constants
+# The person fields kept in the snapshot.  Every row written by
+# 00_update_server_data.py has each of them.
+FIELDS = (
+    'id', 'name', 'nomen', 'cognomen', 'highestOffice', 'birth', 'death',
+    'triumphator', 'fatherID', 'fatherIsUncertain', 'grandfatherID',
+    'grandfatherIsUncertain'
+)
+# Increase when the snapshot's tables change, so old snapshots are rebuilt.
+SNAPSHOT_VERSION = 2
+
+
+def contentHash(path):
+    """
+    Hash the contents of a file.
+
+    :param path: The path of the file.
+    :return: The SHA-1 hex digest of its bytes.
+    """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def personHash(person_json):
+    """
+    Hash one person's JSON, independent of key order.
+
+    :param person_json: A JSON object with person information.
+    :return: The SHA-1 hex digest of the person's data.
+    """
+    person_text = json.dumps(person_json, sort_keys=True)
+    return hashlib.sha1(person_text.encode('utf-8')).hexdigest()
+
+
+def parseOverrides(override_path):
+    """
+    Read the manual overrides for people.
+
+    If a person is listed more than once, only their last entry is used.
+
+    :param override_path: The path of json/override_data.json.
+    :return: A dict from each person's ID to a dict from field to its
+    override value.
+    """
+    with open(override_path, 'r', encoding='utf-8') as f:
+        override_json = json.load(f)['people']
+    overrides = {}
+    for person in override_json:
+        overrides[person['id']] = {
+            key: person[key]['value'] for key in person.keys() if key != 'id'
+        }
+    return overrides
+
+
+def openSnapshot(snapshot_path):
+    """
+    Open a snapshot, starting a new one if it is missing, unreadable, or from
+    an older version.
+
+    :param snapshot_path: The path of the SQLite file.
+    :return: An sqlite3 connection to the snapshot.
+    """
+    conn = sqlite3.connect(snapshot_path)
+    try:
+        version = conn.execute('SELECT version FROM snapshot').fetchone()
+        if version == (SNAPSHOT_VERSION,):
+            return conn
+    except sqlite3.DatabaseError:
+        pass
+    conn.close()
+    os.remove(snapshot_path)
+    conn = sqlite3.connect(snapshot_path)
+    with conn:
+        # Columns have no declared type, so each value keeps the type it had
+        # in the JSON.
+        conn.execute(f'CREATE TABLE person({", ".join(FIELDS)}, hash)')
+        # Values are stored as JSON text, since an override may set any JSON
+        # value.
+        conn.execute(
+            'CREATE TABLE override(id, field, value, PRIMARY KEY (id, field)) '
+            'WITHOUT ROWID'
+        )
+        conn.execute(
+            'CREATE TABLE snapshot(version, server_hash, override_hash)'
+        )
+        conn.execute(
+            'INSERT INTO snapshot VALUES (?, NULL, NULL)',
+            (SNAPSHOT_VERSION,)
+        )
+    return conn
+
+
+def writePeople(conn, server_path, server_hash):
+    """
+    Replace the person table with the rows of the server data.
+
+    A person listed more than once keeps the position of their first row and
+    the data of their last.
+
+    :param conn: An sqlite3 connection to the snapshot.
+    :param server_path: The path of json/database_data.json.
+    :param server_hash: The contentHash of the server data.
+    """
+    with open(server_path, 'r', encoding='utf-8') as f:
+        server_json = json.load(f)
+    people = {}
+    for person_json in server_json:
+        people[person_json['id']] = person_json
+    placeholders = ', '.join('?' * (len(FIELDS) + 1))
+    with conn:
+        conn.execute('DELETE FROM person')
+        conn.executemany(
+            f'INSERT INTO person VALUES ({placeholders})',
+            [
+                [person_json.get(field, None) for field in FIELDS]
+                + [personHash(person_json)]
+                for person_json in people.values()
+            ]
+        )
+        conn.execute(
+            'UPDATE snapshot SET server_hash = ?',
+            (server_hash,)
+        )
+
+
+def writeOverrides(conn, override_path, override_hash):
+    """
+    Replace the override table with the manual overrides.  Takes time in
+    proportion to the number of overrides.
+
+    :param conn: An sqlite3 connection to the snapshot.
+    :param override_path: The path of json/override_data.json.
+    :param override_hash: The contentHash of the override file.
+    """
+    overrides = parseOverrides(override_path)
+    with conn:
+        conn.execute('DELETE FROM override')
+        conn.executemany('INSERT INTO override VALUES (?, ?, ?)', [
+            (person_id, field, json.dumps(value, ensure_ascii=False))
+            for (person_id, fields) in overrides.items()
+            for (field, value) in fields.items()
+        ])
+        conn.execute(
+            'UPDATE snapshot SET override_hash = ?',
+            (override_hash,)
+        )
+
+
+def updateSnapshot(server_path, override_path, snapshot_path):
+    """
+    Rebuild whichever tables of a snapshot are stale.
+
+    :param server_path: The path of json/database_data.json.
+    :param override_path: The path of json/override_data.json.
+    :param snapshot_path: The path of the SQLite file.
+    :return: An sqlite3 connection to the up to date snapshot.
+    """
+    conn = openSnapshot(snapshot_path)
+    (saved_server_hash, saved_override_hash) = conn.execute(
+        'SELECT server_hash, override_hash FROM snapshot'
+    ).fetchone()
+    server_hash = contentHash(server_path)
+    if server_hash != saved_server_hash:
+        print(
+            f'Rebuilding the snapshot of {server_path} at {snapshot_path}.'
+        )
+        writePeople(conn, server_path, server_hash)
+    override_hash = contentHash(override_path)
+    if override_hash != saved_override_hash:
+        print(
+            f'Rebuilding the overrides from {override_path} at '
+            f'{snapshot_path}.'
+        )
+        writeOverrides(conn, override_path, override_hash)
+    return conn
+
+
+def readPeople(conn):
+    """
+    Read the person data from a snapshot, with the overrides applied.
+
+    :param conn: An sqlite3 connection to the snapshot.
+    :return: A list of (person JSON, person hash) in the order of the server
+    data.
+    """
+    overrides = {}
+    for (person_id, field, value) in conn.execute(
+        'SELECT id, field, value FROM override'
+    ):
+        overrides.setdefault(person_id, {})[field] = json.loads(value)
+    people = []
+    for row in conn.execute('SELECT * FROM person ORDER BY rowid'):
+        person_json = dict(zip(FIELDS, row[:-1]))
+        person_hash = row[-1]
+        # Only overridden people need to be hashed again.
+        if person_json['id'] in overrides:
+            person_json.update(overrides[person_json['id']])
+            person_hash = personHash(person_json)
+        people.append((person_json, person_hash))
+    return people
+
+
+def loadPeople(server_path, override_path, snapshot_path):
+    """
+    Load the combined person data, updating the snapshot first if it is
+    stale.
+
+    :param server_path: The path of json/database_data.json.
+    :param override_path: The path of json/override_data.json.
+    :param snapshot_path: The path of the SQLite file.
+    :return: A list of (person JSON, person hash) in the order of the server
+    data.
+    """
+    conn = updateSnapshot(server_path, override_path, snapshot_path)
+    try:
+        return readPeople(conn)
+    finally:
+        conn.close()
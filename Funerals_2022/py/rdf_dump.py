@@ -0,0 +1,463 @@
+"""
+Reads a DPRR RDF dump from disk, so the database can be rebuilt without
+querying the server.
+
+Triples are parsed one statement at a time, and only the types and predicates
+the DPRR queries use are kept in memory.  N-Triples files (.nt) are read with a
+fast line parser.  Anything else is read as Turtle, which also accepts
+N-Triples.  Either may be gzip compressed (.gz).
+"""
+
+# Imports
+import gzip
+import re
+
+# Constants
+VOCAB = 'http://romanrepublic.ac.uk/rdf/ontology#'
+ENTITY = 'http://romanrepublic.ac.uk/rdf/entity/'
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+# The vocab: types and predicates used by the DPRR queries.  All other triples
+# are skipped.
+KEPT_TYPES = {VOCAB + name for name in [
+    'Person', 'RelationshipAssertion', 'Relationship', 'PostAssertion'
+]}
+KEPT_PREDICATES = {VOCAB + name for name in [
+    'hasID', 'hasName', 'isSex', 'hasNomen', 'hasCognomen', 'hasEraFrom',
+    'hasEraTo', 'hasHighestOffice', 'isAboutPerson', 'hasRelatedPerson',
+    'hasRelationship', 'isUncertain', 'hasOffice'
+]}
+
+# One N-Triples statement: subject, predicate, object, and the closing period.
+NTRIPLE_PATTERN = re.compile(r'''
+    \s*(<[^>]*>|_:\S+)
+    \s*<([^>]*)>
+    \s*(<[^>]*>|_:\S+|"(?:[^"\\]|\\.)*"(?:@[\w-]+|\^\^<[^>]*>)?)
+    \s*\.\s*(?:\#.*)?$
+''', re.VERBOSE)
+TURTLE_TOKEN_PATTERN = re.compile(r'''
+    (?P<space>\s+|\#[^\n]*)
+    |(?P<iri><[^<>"{}|^`\\\s]*>)
+    |(?P<long_string>"""(?:[^"\\]|\\.|"(?!""))*"""
+        |\'\'\'(?:[^'\\]|\\.|'(?!\'\'))*\'\'\')
+    |(?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    |(?P<lang>@[A-Za-z]+(?:-[A-Za-z0-9]+)*)
+    |(?P<datatype>\^\^)
+    |(?P<number>[+-]?(?:\d+\.\d*[eE][+-]?\d+|\.?\d+[eE][+-]?\d+|\d*\.\d+|\d+))
+    |(?P<blank_node>_:[\w-]+(?:\.[\w-]+)*)
+    |(?P<name>(?:[A-Za-z][\w-]*(?:\.[\w-]+)*)?
+        :(?:(?:[\w:%-]|\\[_~.!$&'()*+,;=/?\#@%-])+
+            (?:\.(?:[\w:%-]|\\[_~.!$&'()*+,;=/?\#@%-])+)*)?
+        |[A-Za-z]+)
+    |(?P<punctuation>[;,.\[\]()])
+''', re.VERBOSE)
+ESCAPE_PATTERN = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+ESCAPES = {
+    't': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f',
+    '"': '"', "'": "'", '\\': '\\'
+}
+
+
+def unescape(text):
+    """
+    Replace the escape sequences in an RDF string or IRI.
+
+    :param text: The text between the quotes or angle brackets.
+    :return: The unescaped text.
+    """
+    if '\\' not in text:
+        return text
+
+    def replace(match):
+        code = match.group(1) or match.group(2)
+        if code is not None:
+            return chr(int(code, 16))
+        return ESCAPES.get(match.group(3), match.group(0))
+
+    return ESCAPE_PATTERN.sub(replace, text)
+
+
+def openDump(path):
+    """
+    Open a dump for reading as text, decompressing it if its name ends in .gz.
+
+    :param path: The path of the dump.
+    :return: An open text file.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def parseNTriplesObject(text):
+    """
+    Get the value of the object of an N-Triples statement.
+
+    :param text: The object as written in the file.
+    :return: The IRI or blank node label, or the lexical form of a literal.
+    """
+    if text.startswith('<'):
+        return unescape(text[1:-1])
+    if text.startswith('"'):
+        return unescape(text[1:text.rindex('"')])
+    return text
+
+
+def readNTriples(f):
+    """
+    Stream the triples of an N-Triples file, one line at a time.
+
+    :param f: An open text file.
+    :return: A generator of (subject, predicate, object) strings. IRIs are
+        given without angle brackets and literals by their lexical form, as in
+        a SPARQL JSON response.
+    """
+    for line_number, line in enumerate(f, start=1):
+        if line.isspace() or line.lstrip().startswith('#'):
+            continue
+        match = NTRIPLE_PATTERN.match(line)
+        if match is None:
+            raise ValueError(
+                f'Line {line_number} is not a valid N-Triples statement: '
+                f'{line.strip()}'
+            )
+        subject, predicate, rdf_object = match.groups()
+        if subject.startswith('<'):
+            subject = unescape(subject[1:-1])
+        yield (subject, unescape(predicate), parseNTriplesObject(rdf_object))
+
+
+class TurtleReader():
+    """
+    Parses a Turtle file one statement at a time, without reading the whole
+    file.
+    """
+
+    def __init__(self, f):
+        """
+        Create a reader positioned at the start of the file.
+
+        :param f: An open text file.
+        """
+        self.f = f
+        self.line_number = 0
+        self.tokens = self.readTokens()
+        self.next_token = next(self.tokens, None)
+        self.prefixes = {}
+        self.base = ''
+        self.blank_node_count = 0
+        self.pending = []
+
+    def readTokens(self):
+        """
+        Split the file into tokens, reading a line at a time.  Only long
+        strings may span lines.
+
+        :return: A generator of (kind, text) tuples.
+        """
+        buffer = ''
+        pos = 0
+        for line in self.f:
+            self.line_number += 1
+            buffer = buffer[pos:] + line
+            pos = 0
+            while pos < len(buffer):
+                match = TURTLE_TOKEN_PATTERN.match(buffer, pos)
+                at_long_string = buffer.startswith(('"""', "'''"), pos)
+                if match is None or (
+                    match.lastgroup == 'string' and at_long_string
+                ):
+                    if at_long_string:
+                        # An unfinished long string. Wait for the next line.
+                        break
+                    raise ValueError(
+                        f'Unexpected text on line {self.line_number}: '
+                        f'{buffer[pos:].strip()}'
+                    )
+                pos = match.end()
+                if match.lastgroup != 'space':
+                    yield (match.lastgroup, match.group())
+        if pos < len(buffer):
+            raise ValueError(
+                'Unfinished string at the end of the file: '
+                f'{buffer[pos:].strip()}'
+            )
+
+    def peek(self):
+        """
+        Get the next token without consuming it.
+
+        :return: The next (kind, text) tuple, or None at the end of the file.
+        """
+        return self.next_token
+
+    def take(self):
+        """
+        Consume the next token.
+
+        :return: The (kind, text) tuple consumed.
+        """
+        token = self.next_token
+        if token is None:
+            raise ValueError('Unexpected end of the Turtle file.')
+        self.next_token = next(self.tokens, None)
+        return token
+
+    def expect(self, text):
+        """
+        Consume the next token, which must be the given punctuation.
+
+        :param text: The expected punctuation.
+        """
+        token = self.take()
+        if token[1] != text:
+            raise ValueError(
+                f'Expected {text!r} near line {self.line_number}, '
+                f'found {token[1]!r}.'
+            )
+
+    def expandName(self, name):
+        """
+        Expand a prefixed name to a full IRI.
+
+        :param name: The prefixed name, such as vocab:Person.  Escaped
+            characters in the local name, such as the slash in e:Sex\\/Male,
+            are unescaped.
+        :return: The full IRI.
+        """
+        prefix, local_name = name.split(':', 1)
+        if prefix not in self.prefixes:
+            raise ValueError(
+                f'Unknown prefix {prefix!r} near line {self.line_number}.'
+            )
+        return self.prefixes[prefix] + re.sub(r'\\(.)', r'\1', local_name)
+
+    def iri(self, text):
+        """
+        Resolve an IRI written in angle brackets against the base IRI.
+
+        :param text: The IRI including its angle brackets.
+        :return: The full IRI.
+        """
+        iri = unescape(text[1:-1])
+        if ':' not in iri:
+            iri = self.base + iri
+        return iri
+
+    def term(self):
+        """
+        Read a subject or object, including any triples nested in a blank
+        node property list.
+
+        :return: The IRI or blank node label, or the lexical form of a literal.
+        """
+        kind, text = self.take()
+        if kind == 'iri':
+            return self.iri(text)
+        if kind == 'name':
+            if text in ('true', 'false'):
+                return text
+            return self.expandName(text)
+        if kind == 'blank_node':
+            return text
+        if kind in ('string', 'long_string'):
+            quote_length = 3 if kind == 'long_string' else 1
+            value = unescape(text[quote_length:-quote_length])
+            next_token = self.peek()
+            if next_token is not None and next_token[0] == 'lang':
+                self.take()
+            elif next_token is not None and next_token[0] == 'datatype':
+                self.take()
+                self.term()
+            return value
+        if kind == 'number':
+            return text
+        if text == '[':
+            self.blank_node_count += 1
+            blank_node = f'_:b{self.blank_node_count}'
+            if self.peek() != ('punctuation', ']'):
+                self.predicateObjectList(blank_node)
+            self.expect(']')
+            return blank_node
+        if text == '(':
+            raise ValueError(
+                'RDF collections are not supported '
+                f'(line {self.line_number}).'
+            )
+        raise ValueError(f'Unexpected {text!r} near line {self.line_number}.')
+
+    def predicateObjectList(self, subject):
+        """
+        Read the predicates and objects of a subject, adding each triple to
+        the pending list.
+
+        :param subject: The subject of the triples.
+        """
+        while True:
+            kind, text = self.take()
+            if kind == 'name' and text == 'a':
+                predicate = RDF_TYPE
+            elif kind == 'iri':
+                predicate = self.iri(text)
+            elif kind == 'name':
+                predicate = self.expandName(text)
+            else:
+                raise ValueError(
+                    f'Expected a predicate near line {self.line_number}, '
+                    f'found {text!r}.'
+                )
+            self.pending.append((subject, predicate, self.term()))
+            while self.peek() == ('punctuation', ','):
+                self.take()
+                self.pending.append((subject, predicate, self.term()))
+            if self.peek() != ('punctuation', ';'):
+                return
+            while self.peek() == ('punctuation', ';'):
+                self.take()
+            if self.peek() in (('punctuation', '.'), ('punctuation', ']')):
+                return
+
+    def directive(self):
+        """
+        Read a prefix or base directive, in either Turtle or SPARQL style.
+
+        :return: True if a directive was read, or False if the next
+            statement holds triples.
+        """
+        kind, text = self.peek()
+        keyword = text.lower()
+        if kind == 'lang' and keyword in ('@prefix', '@base'):
+            keyword = keyword[1:]
+            closing_period = True
+        elif kind == 'name' and keyword in ('prefix', 'base'):
+            closing_period = False
+        else:
+            return False
+        self.take()
+        if keyword == 'prefix':
+            prefix = self.take()[1]
+            self.prefixes[prefix[:-1]] = self.iri(self.take()[1])
+        else:
+            self.base = self.iri(self.take()[1])
+        if closing_period:
+            self.expect('.')
+        return True
+
+    def triples(self):
+        """
+        Stream the triples of the file.
+
+        :return: A generator of (subject, predicate, object) strings, as from
+            readNTriples().
+        """
+        while self.peek() is not None:
+            if self.directive():
+                continue
+            subject = self.term()
+            # A blank node property list may stand alone as a statement.
+            if (self.peek() != ('punctuation', '.')
+                    or not subject.startswith('_:')):
+                self.predicateObjectList(subject)
+            self.expect('.')
+            yield from self.pending
+            self.pending = []
+
+
+def readTriples(f, path):
+    """
+    Stream the triples of a dump, choosing the parser from its file name.
+
+    :param f: The dump, as returned by openDump().
+    :param path: The path of the dump.
+    :return: A generator of (subject, predicate, object) strings.
+    """
+    if path.endswith(('.nt', '.nt.gz')):
+        return readNTriples(f)
+    return TurtleReader(f).triples()
+
+
+class DprrGraph():
+    """The parts of a DPRR dump the queries use, indexed by subject."""
+
+    def __init__(self):
+        """Create an empty graph."""
+        self.types = {}
+        self.type_sets = {}
+        self.values = {}
+        self.triple_count = 0
+
+    def add(self, subject, predicate, rdf_object):
+        """
+        Keep a triple if the DPRR queries use it.
+
+        :param subject: The subject of the triple.
+        :param predicate: The predicate of the triple.
+        :param rdf_object: The object of the triple.
+        """
+        self.triple_count += 1
+        if predicate == RDF_TYPE:
+            if rdf_object in KEPT_TYPES:
+                type_name = rdf_object[len(VOCAB):]
+                self.types.setdefault(type_name, []).append(subject)
+                self.type_sets.pop(type_name, None)
+        elif predicate in KEPT_PREDICATES:
+            subject_values = self.values.setdefault(subject, {}).setdefault(
+                predicate[len(VOCAB):], []
+            )
+            # Repeated triples are kept once, as SELECT DISTINCT would.
+            if rdf_object not in subject_values:
+                subject_values.append(rdf_object)
+
+    def subjects(self, type_name):
+        """
+        Get the subjects of a type, in the order the dump declares them.
+
+        :param type_name: The local name of the type, such as 'Person'.
+        :return: A list of subjects.
+        """
+        return list(dict.fromkeys(self.types.get(type_name, [])))
+
+    def isA(self, subject, type_name):
+        """
+        Check a subject's type.
+
+        :param subject: The subject to check.
+        :param type_name: The local name of the type.
+        :return: True if the dump declares subject to have that type.
+        """
+        return subject in self.typeSet(type_name)
+
+    def typeSet(self, type_name):
+        """
+        Get the subjects of a type as a set, building it on first use.
+
+        :param type_name: The local name of the type.
+        :return: A set of subjects.
+        """
+        if type_name not in self.type_sets:
+            self.type_sets[type_name] = set(self.types.get(type_name, []))
+        return self.type_sets[type_name]
+
+    def get(self, subject, predicate_name):
+        """
+        Get the values of a predicate for a subject.
+
+        :param subject: The subject.
+        :param predicate_name: The local name of the predicate, such as
+            'hasID'.
+        :return: A list of values, empty if there are none.
+        """
+        return self.values.get(subject, {}).get(predicate_name, [])
+
+
+def loadGraph(path):
+    """
+    Read a dump into a DprrGraph in one pass.
+
+    :param path: The path of the dump.
+    :return: The DprrGraph.
+    """
+    graph = DprrGraph()
+    with openDump(path) as f:
+        for (subject, predicate, rdf_object) in readTriples(f, path):
+            graph.add(subject, predicate, rdf_object)
+    return graph
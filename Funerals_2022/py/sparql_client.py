@@ -0,0 +1,556 @@
+"""
+Sends SPARQL queries to the DPRR server, keeping raw responses in an on-disk
+cache.
+
+Cached responses are keyed by a hash of the endpoint, query, and result format.
+Depending on the mode, the cache is revalidated with the server, used without
+any network access, or bypassed.
+"""
+
+# Imports
+import codecs
+import csv
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+# requests is only needed when the network is used, so replay mode can run
+# without it.
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except ImportError:
+    requests = None
+
+# Cache modes
+# REVALIDATE uses fresh cache entries and otherwise asks the server if the
+# entry changed.  REPLAY only serves cached responses and never touches the
+# network.  REFRESH always downloads, then stores the response in the cache.
+# OFF always downloads and does not store anything.
+REVALIDATE = 'revalidate'
+REPLAY = 'replay'
+REFRESH = 'refresh'
+OFF = 'off'
+CACHE_MODES = (REVALIDATE, REPLAY, REFRESH, OFF)
+
+# Result formats.  CSV and TSV are several times smaller than JSON, which wraps
+# every value in an object.
+JSON_FORMAT = 'application/json'
+CSV_FORMAT = 'text/csv'
+TSV_FORMAT = 'text/tab-separated-values'
+RESULT_FORMATS = (JSON_FORMAT, CSV_FORMAT, TSV_FORMAT)
+CHUNK_SIZE = 64 * 1024
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+ESCAPE_PATTERN = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))')
+ESCAPES = {
+    't': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f',
+    '"': '"', "'": "'", '\\': '\\'
+}
+
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a query has no recorded response."""
+
+
+# Errors raised when a download fails, which are worth retrying.  Empty if
+# requests is not installed.
+NETWORK_ERRORS = (requests.RequestException,) if requests is not None else ()
+
+
+class SparqlClient():
+    """
+    Runs SPARQL queries against an endpoint through an on-disk response cache.
+    """
+
+    def __init__(self, endpoint, cache_dir, mode=REVALIDATE, ttl=0, retries=3,
+                 backoff=1.0):
+        """
+        Create a new client.
+
+        All requests share one keep-alive session, so the client may be used
+        from several threads.
+
+        :param endpoint: The URL of the SPARQL endpoint.
+        :param cache_dir: The directory where responses are stored.
+        :param mode: One of REVALIDATE, REPLAY, REFRESH, or OFF.
+        :param ttl: Seconds a cached response is used without revalidating it.
+            0 always revalidates.
+        :param retries: How many times a failed connection or server error is
+            retried.
+        :param backoff: Base delay in seconds between retries. Doubles on each
+            retry.
+        """
+        if mode not in CACHE_MODES:
+            raise ValueError(
+                f'Unknown cache mode {mode}. Expected one of {CACHE_MODES}.'
+            )
+        self.endpoint = endpoint
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.ttl = ttl
+        self.session = None
+        if requests is not None and mode != REPLAY:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=['GET']
+            ))
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        if mode != OFF:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def close(self):
+        """Close the shared session and its pooled connections."""
+        if self.session is not None:
+            self.session.close()
+
+    def cacheKey(self, query, result_format):
+        """
+        Get the cache key for a query.
+
+        :param query: The SPARQL query.
+        :param result_format: The requested result format.
+        :return: A hex digest identifying this query.
+        """
+        key_source = '\n'.join([self.endpoint, result_format, query])
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def cachePaths(self, key):
+        """
+        Get the paths of the cached body and its metadata.
+
+        :param key: The cache key, as returned by cacheKey().
+        :return: A tuple of (body_path, metadata_path).
+        """
+        return (
+            os.path.join(self.cache_dir, f'{key}.body'),
+            os.path.join(self.cache_dir, f'{key}.meta.json')
+        )
+
+    def readMetadata(self, key):
+        """
+        Read the metadata for a cached response.
+
+        :param key: The cache key.
+        :return: The metadata dict, or None if nothing usable is cached.
+        """
+        body_path, meta_path = self.cachePaths(key)
+        if not os.path.exists(body_path) or not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def writeMetadata(self, key, metadata):
+        """
+        Save the metadata for a cached response.
+
+        :param key: The cache key.
+        :param metadata: The metadata dict to save.
+        """
+        meta_path = self.cachePaths(key)[1]
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=4)
+
+    def download(self, query, result_format, metadata, f):
+        """
+        Request the query from the server, streaming the body into a file.
+
+        :param query: The SPARQL query.
+        :param result_format: The requested result format.
+        :param metadata: Cached metadata used for a conditional request, or
+            None.
+        :param f: A binary file object to write the response body to.
+        :return: The new metadata, or None if the server reports the cached
+            body is unchanged.
+        """
+        if self.session is None:
+            raise ImportError(
+                'requests is required to query the DPRR server.'
+            )
+        # requests decompresses the body as it streams, so the cache stores
+        # plain text.
+        headers = {'Accept-Encoding': 'gzip'}
+        if metadata is not None:
+            if metadata.get('etag'):
+                headers['If-None-Match'] = metadata['etag']
+            if metadata.get('last_modified'):
+                headers['If-Modified-Since'] = metadata['last_modified']
+        with self.session.get(
+            self.endpoint,
+            params={'query': query, 'format': result_format},
+            headers=headers,
+            stream=True
+        ) as results:
+            if results.status_code == 304 and metadata is not None:
+                return None
+            # If the server is down, raise an exception and end.
+            results.raise_for_status()
+            body_bytes = 0
+            for chunk in results.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                body_bytes += len(chunk)
+            return {
+                'etag': results.headers.get('ETag'),
+                'last_modified': results.headers.get('Last-Modified'),
+                'fetched_at': time.time(),
+                'query': query,
+                'format': result_format,
+                'body_bytes': body_bytes,
+                # The size on the wire, before decompression.
+                'transfer_bytes': results.raw.tell()
+            }
+
+    def openQuery(self, query, result_format=JSON_FORMAT, revalidate=True):
+        """
+        Get the raw response to a query as a binary file object.
+
+        :param query: The SPARQL query.
+        :param result_format: The requested result format.
+        :param revalidate: If False, any cached response is used as is,
+            whatever its age or the cache mode.
+        :return: An open binary file containing the response body. The
+            caller must close it.
+        """
+        if self.mode == OFF:
+            f = tempfile.TemporaryFile()
+            self.download(query, result_format, None, f)
+            f.seek(0)
+            return f
+
+        key = self.cacheKey(query, result_format)
+        body_path = self.cachePaths(key)[0]
+        metadata = None
+        if self.mode != REFRESH or not revalidate:
+            metadata = self.readMetadata(key)
+        if self.mode == REPLAY:
+            if metadata is None:
+                raise CacheMissError(
+                    f'No recorded response for query with key {key}.'
+                )
+            return open(body_path, 'rb')
+
+        if metadata is not None and (
+            not revalidate
+            or time.time() - metadata.get('fetched_at', 0) < self.ttl
+        ):
+            return open(body_path, 'rb')
+
+        # Write to a temporary file so a failed download never replaces a good
+        # cached body.
+        temp_path = body_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            new_metadata = self.download(query, result_format, metadata, f)
+        if new_metadata is None:
+            os.remove(temp_path)
+            metadata['fetched_at'] = time.time()
+            new_metadata = metadata
+        else:
+            os.replace(temp_path, body_path)
+        self.writeMetadata(key, new_metadata)
+        return open(body_path, 'rb')
+
+    def query(self, query):
+        """
+        Run a query and parse the JSON response.
+
+        :param query: The SPARQL query.
+        :return: The parsed JSON response.
+        """
+        with self.openQuery(query, JSON_FORMAT) as f:
+            return json.load(f)
+
+
+class JsonStreamReader():
+    """
+    Decodes JSON values one at a time from a binary file, keeping only a small
+    buffer in memory.
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        """
+        Create a reader positioned at the start of the file.
+
+        :param f: A binary file object containing UTF-8 JSON.
+        :param chunk_size: How many bytes to read at a time.
+        """
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Read the next chunk into the buffer, dropping text that has already
+        been consumed.
+
+        :return: False if the file has no more data, or True otherwise.
+        """
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        text = self.text_decoder.decode(chunk, final=not chunk)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+        return True
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character without consuming it.
+
+        :return: The next character, or None at the end of the file.
+        """
+        while True:
+            while (self.pos < len(self.buffer)
+                   and self.buffer[self.pos].isspace()):
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, characters):
+        """
+        Consume the next non-whitespace character, which must be one of
+        characters.
+
+        :param characters: The allowed characters.
+        :return: The character consumed.
+        """
+        character = self.peek()
+        if character is None or character not in characters:
+            raise ValueError(
+                f'Expected one of {characters!r} in SPARQL JSON, '
+                f'found {character!r}.'
+            )
+        self.pos += 1
+        return character
+
+    def value(self):
+        """
+        Decode the next complete JSON value.
+
+        :return: The decoded value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(
+                    self.buffer, self.pos
+                )
+                # A value ending exactly at the end of the buffer (such as a
+                # number) may continue in the next chunk.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def objectItems(self):
+        """
+        Iterate over the keys of the object starting at the current position.
+
+        The caller must consume each key's value, with value() or a nested
+        reader call, before the next key.
+
+        :return: A generator of keys.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def arrayItems(self):
+        """
+        Decode the array starting at the current position, one element at a
+        time.
+
+        :return: A generator of decoded elements.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def iterBindings(f):
+    """
+    Stream the rows of a SPARQL JSON response without loading the whole
+    response.
+
+    :param f: A binary file object containing the response, such as one from
+        SparqlClient.openQuery().
+    :return: A generator of dicts mapping each bound variable to its value.
+        Unbound variables are left out.
+    """
+    reader = JsonStreamReader(f)
+    for key in reader.objectItems():
+        if key != 'results':
+            reader.value()
+            continue
+        for results_key in reader.objectItems():
+            if results_key != 'bindings':
+                reader.value()
+                continue
+            for binding in reader.arrayItems():
+                yield {
+                    variable: cell['value']
+                    for variable, cell in binding.items()
+                }
+
+
+def unescapeTerm(text):
+    """
+    Replace the escape sequences in a string or IRI written in N-Triples
+    syntax.
+
+    :param text: The text between the quotes or angle brackets.
+    :return: The unescaped text.
+    """
+    if '\\' not in text:
+        return text
+
+    def replace(match):
+        code = match.group(1) or match.group(2)
+        if code is not None:
+            return chr(int(code, 16))
+        return ESCAPES.get(match.group(3), match.group(0))
+
+    return ESCAPE_PATTERN.sub(replace, text)
+
+
+def parseTsvTerm(text):
+    """
+    Get the value of an RDF term from a SPARQL TSV response, matching the
+    value in a JSON response.
+
+    :param text: The term as written in the response, such as <http://...>,
+        "text"@en, or 12.
+    :return: The IRI, the lexical form of a literal, or the blank node label.
+    """
+    if text.startswith('<') and text.endswith('>'):
+        return unescapeTerm(text[1:-1])
+    if text.startswith('"'):
+        return unescapeTerm(text[1:text.rindex('"')])
+    # Numbers and booleans may be written bare.
+    return text
+
+
+def iterCsvRows(f):
+    """
+    Stream the rows of a SPARQL CSV response.
+
+    CSV cannot tell an unbound variable from an empty string, so empty cells
+    are treated as unbound.
+
+    :param f: A binary file object containing the response.
+    :return: A generator of dicts mapping each bound variable to its value, as
+        from iterBindings().
+    """
+    reader = csv.reader(codecs.iterdecode(f, 'utf-8'))
+    variables = next(reader, [])
+    for row in reader:
+        yield {
+            variable: value
+            for variable, value in zip(variables, row) if value != ''
+        }
+
+
+def iterTsvRows(f):
+    """
+    Stream the rows of a SPARQL TSV response.
+
+    :param f: A binary file object containing the response.
+    :return: A generator of dicts mapping each bound variable to its value, as
+        from iterBindings().
+    """
+    lines = codecs.iterdecode(f, 'utf-8')
+    header = next(lines, '')
+    variables = [
+        variable.lstrip('?$')
+        for variable in header.rstrip('\r\n').split('\t')
+    ]
+    for line in lines:
+        cells = line.rstrip('\r\n').split('\t')
+        yield {
+            variable: parseTsvTerm(cell)
+            for variable, cell in zip(variables, cells) if cell != ''
+        }
+
+
+def iterRows(f, result_format=JSON_FORMAT):
+    """
+    Stream the rows of a response in any of RESULT_FORMATS.
+
+    :param f: A binary file object containing the response.
+    :param result_format: The format the response was requested in.
+    :return: A generator of dicts mapping each bound variable to its value.
+    """
+    if result_format == JSON_FORMAT:
+        return iterBindings(f)
+    if result_format == CSV_FORMAT:
+        return iterCsvRows(f)
+    if result_format == TSV_FORMAT:
+        return iterTsvRows(f)
+    raise ValueError(
+        f'Unknown result format {result_format}. '
+        f'Expected one of {RESULT_FORMATS}.'
+    )
+
+
+def benchmarkFormats(client, query, result_formats=RESULT_FORMATS):
+    """
+    Download a query in each result format, bypassing the cache, and time how
+    long each takes to parse.
+
+    :param client: The SparqlClient used to download the query.
+    :param query: The SPARQL query.
+    :param result_formats: The formats to compare. The first is the reference
+        for same_rows.
+    :return: A list of dicts, one per format, with format, transfer_bytes,
+        body_bytes, parse_seconds, row_count, and same_rows (whether the rows
+        equal those of the first format).
+    """
+    results = []
+    reference_rows = None
+    for result_format in result_formats:
+        with tempfile.TemporaryFile() as f:
+            metadata = client.download(query, result_format, None, f)
+            f.seek(0)
+            start = time.perf_counter()
+            rows = list(iterRows(f, result_format))
+            parse_seconds = time.perf_counter() - start
+        if reference_rows is None:
+            reference_rows = rows
+        results.append({
+            'format': result_format,
+            'transfer_bytes': metadata['transfer_bytes'],
+            'body_bytes': metadata['body_bytes'],
+            'parse_seconds': parse_seconds,
+            'row_count': len(rows),
+            'same_rows': rows == reference_rows
+        })
+    return results
@@ -0,0 +1,89 @@
+"""
+Tests the N-Triples and Turtle parsers in rdf_dump.py.
+
+Run with pytest from this directory.
+"""
+
+# Imports
+import io
+
+import pytest
+
+import rdf_dump
+
+# Constants
+PERSON = rdf_dump.ENTITY + 'Person/1'
+MALE = rdf_dump.ENTITY + 'Sex/Male'
+
+
+def readTurtle(text):
+    """
+    Parse Turtle text.
+
+    :param text: The Turtle document.
+    :return: A list of (subject, predicate, object) strings.
+    """
+    return list(rdf_dump.TurtleReader(io.StringIO(text)).triples())
+
+
+def test_ntriples():
+    text = (
+        f'<{PERSON}> <{rdf_dump.VOCAB}hasName> "Gaius \\"Maximus\\""@la .\n'
+        '# A comment line.\n'
+        f'<{PERSON}> <{rdf_dump.VOCAB}isSex> <{MALE}> .\n'
+    )
+    assert list(rdf_dump.readNTriples(io.StringIO(text))) == [
+        (PERSON, rdf_dump.VOCAB + 'hasName', 'Gaius "Maximus"'),
+        (PERSON, rdf_dump.VOCAB + 'isSex', MALE)
+    ]
+
+
+def test_ntriples_rejects_incomplete_statement():
+    with pytest.raises(ValueError):
+        list(rdf_dump.readNTriples(io.StringIO(f'<{PERSON}> <p> .\n')))
+
+
+def test_turtle_prefixes_and_lists():
+    text = f'''
+        @prefix vocab: <{rdf_dump.VOCAB}> .
+        PREFIX e: <{rdf_dump.ENTITY}>
+        <{PERSON}> a vocab:Person ;
+            vocab:hasName "P1", """Two
+lines""" ;
+            vocab:hasID 1 .
+    '''
+    assert readTurtle(text) == [
+        (PERSON, rdf_dump.RDF_TYPE, rdf_dump.VOCAB + 'Person'),
+        (PERSON, rdf_dump.VOCAB + 'hasName', 'P1'),
+        (PERSON, rdf_dump.VOCAB + 'hasName', 'Two\nlines'),
+        (PERSON, rdf_dump.VOCAB + 'hasID', '1')
+    ]
+
+
+def test_turtle_escaped_local_names():
+    text = f'''
+        @prefix vocab: <{rdf_dump.VOCAB}> .
+        @prefix e: <{rdf_dump.ENTITY}> .
+        e:Person\\/1 vocab:isSex e:Sex\\/Male ;
+            vocab:hasName e:a\\.b\\.\\(c\\) .
+    '''
+    assert readTurtle(text) == [
+        (PERSON, rdf_dump.VOCAB + 'isSex', MALE),
+        (PERSON, rdf_dump.VOCAB + 'hasName', rdf_dump.ENTITY + 'a.b.(c)')
+    ]
+
+
+def test_turtle_blank_nodes():
+    text = f'''
+        @prefix vocab: <{rdf_dump.VOCAB}> .
+        <{PERSON}> vocab:hasRelationship [ vocab:isUncertain true ] .
+    '''
+    assert readTurtle(text) == [
+        ('_:b1', rdf_dump.VOCAB + 'isUncertain', 'true'),
+        (PERSON, rdf_dump.VOCAB + 'hasRelationship', '_:b1')
+    ]
+
+
+def test_turtle_rejects_unknown_prefix():
+    with pytest.raises(ValueError):
+        readTurtle('x:a x:b x:c .')
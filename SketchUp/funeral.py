@@ -9,6 +9,7 @@
 #Author: Benjamin Niedzielski (bniedzie@ucla.edu)
 #Last Modified: 9/11/2018
 ############################################################################
+import json;
 
 #Globals
 SIZE = 6000;                                #The array size
@@ -19,6 +20,10 @@ triumphFile = "triumphList.csv";            #Contains rows of those who triumphe
 fatherFile = "FatherQuery.csv";             #Contains rows of paternal relations, with format of Son ID, Father ID
 nomenFile = "NomenList.csv";                #Contains rows of Roman males, with the format of ID, , Gens, Cognomen (sic)
 birthFile = "birthQuery.csv";               #Contains rows of Roman males, with the format of ID, Birth date
+exclusionFile = "../Funerals_2022/json/override_data.json";#Contains an exclusions section listing (person ID, candidate ID) pairs that can never be father and son
+impossibleFathers = frozenset();
+impossibleNomenFathers = frozenset();       #Pairs excluded only when guessing a father from the nomen alone
+noInference = frozenset();                  #People whose father is never inferred, since their data is impossible (older than their father)
 nomenDictionary = {};
 
 #A Nomen consists of the name of that nomen and a list of people with that nomen.
@@ -127,8 +132,21 @@ def parseFatherFile():
             allPeople[id].relativeIDs.append(fatherID);
             allPeople[id].relativeType.append("father");
 
+#Parse the impossible father/son pairs from the exclusions section of the shared override file
+def parseExclusionFile():
+    global impossibleFathers, impossibleNomenFathers, noInference;
+    with open(exclusionFile) as f:
+        overrides = json.load(f);
+    exclusions = overrides.get("exclusions", []);
+    pairs = [(int(exclusion["id"]), int(exclusion["candidate"])) for exclusion in exclusions if not exclusion.get("nomenOnly", False)];
+    nomenOnlyPairs = [(int(exclusion["id"]), int(exclusion["candidate"])) for exclusion in exclusions if exclusion.get("nomenOnly", False)];
+    impossibleFathers = frozenset(pairs);
+    impossibleNomenFathers = frozenset(pairs + nomenOnlyPairs);
+    noInference = frozenset(int(personID) for personID in overrides.get("noInference", []));
+
 #Parse all relevant files to set up the people needed
 def parseInput():
+    parseExclusionFile();
     parseNameIDFile();
     parseNomenFile();
     parseBirthFile();
@@ -160,7 +178,7 @@ def recursiveRoles(conservative, verbose, index):
                 return person.bestPosition + " " + recursiveRoles(conservative, verbose, person.relativeIDs[person.relativeType.index("father")]);   
         else:
             #If none is attested, the conservative approach would end.  Special cases for people whose data is impossible (older than their father)
-            if (conservative or index == 1095 or index == 1032 or index == 1235 or index == 4695):
+            if (conservative or index in noInference):
                 if verbose:
                     return "\t" + person.name + " " + person.bestPosition;
                 else:
@@ -174,9 +192,9 @@ def recursiveRoles(conservative, verbose, index):
                     sameNomen = [];
                     for x in nomen.people:
                         #Special cases for people whose data is impossible, as above
-                        if x.cognomen == person.cognomen and x.birthDate < person.birthDate - 22 and (index != 3349 or x.id != 624) and (index != 1235 or x.id != 1032) and (index != 4026 or x.id != 4093):
+                        if x.cognomen == person.cognomen and x.birthDate < person.birthDate - 22 and (index, x.id) not in impossibleFathers:
                             sameCognomen.append(x);
-                        if x.birthDate < person.birthDate - 22 and (index != 3349 or x.id != 624) and (index != 1235 or x.id != 1032) and (index != 4026 or x.id != 4093):
+                        if x.birthDate < person.birthDate - 22 and (index, x.id) not in impossibleNomenFathers:
                             sameNomen.append(x);
                     if (len(sameCognomen) == 0):
                         if (len(sameNomen) == 0):
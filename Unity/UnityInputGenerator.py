@@ -9,6 +9,7 @@
 #Author: Benjamin Niedzielski (bniedzie@ucla.edu)
 #Last Modified: 9/11/2018
 ############################################################################
+import json;
 
 #Globals
 SIZE = 6000;                                        #The array size
@@ -23,6 +24,10 @@ birthFile = "birthQuery.csv";                       #Contains rows of Roman male
 grandfatherFile = "GrandfatherQuery.csv";           #Contains rows of relations, with format of Grandson ID, Grandfather ID
 fatherUCFile = "fatherUncertainQuery.csv";          #Contains rows of relations where the father is uncertain, with format of Son ID, Father ID
 grandfatherUCFile = "grandfatherUncertainQuery.csv";#Contains rows of relations where the grandfather is uncertain, with format of Grandson ID, Grandfather ID
+exclusionFile = "../Funerals_2022/json/override_data.json";#Contains an exclusions section listing (person ID, candidate ID) pairs that can never be father and son
+impossibleFathers = frozenset();
+impossibleNomenFathers = frozenset();               #Pairs excluded only when guessing a father from the nomen alone
+noInference = frozenset();                          #People whose father is never inferred, since their data is impossible (older than their father)
 nomenDictionary = {};
 treetop = 0;
 
@@ -185,8 +190,21 @@ def parseUCGrandfatherFile():
             #Allows support for other types of relationships as well
             allPeople[id].relativeCertainty[allPeople[id].relativeIDs.index(grandfatherID)] = False;
 
+#Parse the impossible father/son pairs from the exclusions section of the shared override file
+def parseExclusionFile():
+    global impossibleFathers, impossibleNomenFathers, noInference;
+    with open(exclusionFile) as f:
+        overrides = json.load(f);
+    exclusions = overrides.get("exclusions", []);
+    pairs = [(int(exclusion["id"]), int(exclusion["candidate"])) for exclusion in exclusions if not exclusion.get("nomenOnly", False)];
+    nomenOnlyPairs = [(int(exclusion["id"]), int(exclusion["candidate"])) for exclusion in exclusions if exclusion.get("nomenOnly", False)];
+    impossibleFathers = frozenset(pairs);
+    impossibleNomenFathers = frozenset(pairs + nomenOnlyPairs);
+    noInference = frozenset(int(personID) for personID in overrides.get("noInference", []));
+
 #Parse all relevant files to set up the people needed
 def parseInput():
+    parseExclusionFile();
     parseNameIDFile();
     parseNomenFile();
     parseCognomenFile();
@@ -254,7 +272,7 @@ def recursiveRoles(conservative, hyperaggressive, verbose, unity, index):
                 else:
                     return person.bestPosition + " " + recursiveRoles(conservative, hyperaggressive, verbose, unity, person.relativeIDs[person.relativeType.index("grandfather")]);  
             #If none is attested, the conservative approach would end.  Special cases for people whose data is impossible (older than their father)
-            if (conservative or index == 1095 or index == 1032 or index == 1235 or index == 4695):
+            if (conservative or index in noInference):
                 if verbose:
                     return "\t" + person.name + " " + person.bestPosition;
                 elif unity:
@@ -274,9 +292,9 @@ def recursiveRoles(conservative, hyperaggressive, verbose, unity, index):
                     sameNomen = [];
                     for x in nomen.people:
                         #Special cases for people whose data is impossible, as above
-                        if x.cognomen == person.cognomen and x.birthDate < person.birthDate - 22 and (index != 3264 or x.id != 3957) and (index != 3264 or x.id != 3956) and (index != 4453 or x.id != 5311) and (index != 5297 or x.id != 4116) and (index != 5297 or x.id != 4118) and (index != 3788 or x.id != 3573) and (index != 3349 or x.id != 624) and (index != 1235 or x.id != 1032) and (index != 4026 or x.id != 4093):
+                        if x.cognomen == person.cognomen and x.birthDate < person.birthDate - 22 and (index, x.id) not in impossibleFathers:
                             sameCognomen.append(x);
-                        if x.birthDate < person.birthDate - 22 and (index != 3264 or x.id != 3957) and (index != 3264 or x.id != 3956) and (index != 4453 or x.id != 5311) and (index != 5297 or x.id != 4116) and (index != 5297 or x.id != 4118) and (index != 3788 or x.id != 3573) and (index != 3349 or x.id != 580) and (index != 3349 or x.id != 624) and (index != 1235 or x.id != 1032) and (index != 4026 or x.id != 4093):
+                        if x.birthDate < person.birthDate - 22 and (index, x.id) not in impossibleNomenFathers:
                             sameNomen.append(x);
                     bestFitId = 0;
                     bestFitBirth = -600;